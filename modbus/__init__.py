@@ -1,2 +1,3 @@
-from .serial_serve import calculate_crc, start_serial_process, serial_manager, get_complete_frames
-from .dataprocess import send_data, return_data_num, clear_receive_queue
+from .serial_serve import calculate_crc, start_serial_process, serial_manager, get_complete_frames, ModbusRequest
+from .crc import crc16, verify_frame, verify_frames, CRC16
+from .dataprocess import send_data, query_data, write_data, return_data_num, clear_receive_queue, start_polling, read_cached
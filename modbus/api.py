@@ -1,16 +1,22 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from dataprocess import send_data, return_data_num, clear_receive_queue
-from serial_serve import start_serial_process, serial_manager, get_complete_frames
-import socket
+from dataprocess import send_data, submit_query, submit_write, return_data_num, clear_receive_queue, start_polling, read_cached
+from serial_serve import start_serial_process, serial_manager, get_complete_frames, PRIORITIES
+from register_cache import decode_values
+from tcp_framing import create_framer, FrameError, FRAMERS, FRAMING_LEGACY
+from modbus_tcp import ModbusTcpGateway, build_unit_map
+from port_shards import stop_shards
+import asyncio
+import atexit
+import multiprocessing
+import queue
+import threading
 import yaml
 import time
 import logging
 from logging.config import dictConfig
 from datetime import datetime
 import os
-import threading
-import json
 import sys
 import serial.tools.list_ports
 
@@ -40,6 +46,15 @@ def load_config():
 config = load_config()
 
 # 然后定义日志相关的类和函数
+# 已创建的日志目录，换文件时不必再逐级检查
+_log_dirs = set()
+
+def _ensure_log_dirs(*dir_paths):
+    for dir_path in dir_paths:
+        if dir_path not in _log_dirs:
+            os.makedirs(dir_path, exist_ok=True)
+            _log_dirs.add(dir_path)
+
 def get_log_file_paths(port_name=None):
     """获取当前的日志文件路径"""
     log_dir = 'logs'
@@ -55,20 +70,13 @@ def get_log_file_paths(port_name=None):
     print_log_dir = os.path.join(base_dir, 'print_log')
     warning_log_dir = os.path.join(base_dir, 'warning_log')
 
-    # 确保目录存在
-    for dir_path in [base_dir, error_log_dir, print_log_dir, warning_log_dir]:
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-
     today_str = datetime.now().strftime('%Y-%m-%d')
     error_today_dir = os.path.join(error_log_dir, today_str)
     print_today_dir = os.path.join(print_log_dir, today_str)
     warning_today_dir = os.path.join(warning_log_dir, today_str)
 
-    # 确保当天的目录存在
-    for dir_path in [error_today_dir, print_today_dir, warning_today_dir]:
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
+    # 确保当天的目录存在（上级目录一并创建）
+    _ensure_log_dirs(error_today_dir, print_today_dir, warning_today_dir)
 
     time_now = datetime.now().strftime('%H')
     error_log_file = os.path.join(error_today_dir, f'error_{time_now}.txt')
@@ -77,8 +85,123 @@ def get_log_file_paths(port_name=None):
 
     return error_log_file, print_log_file, warning_log_file
 
+class LogWriter:
+    """
+    后台日志写入线程
+    - TimedRotatingHandler只把记录放入队列，格式化和写文件都在本线程中完成
+    - 写入先留在文件缓冲区，每flush_interval秒或累计flush_size字节统一flush，ERROR及以上立即flush
+    - 队列满时丢弃INFO及以下的新记录，不阻塞串口收发线程；WARNING及以上最多等待block_timeout秒
+    - 丢弃的条数按处理器累计，由写入线程在对应日志文件中补写一条汇总
+    """
+    _STOP = object()
+
+    def __init__(self, queue_size, flush_interval, flush_size, block_timeout):
+        self.queue = queue.Queue(queue_size)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.block_timeout = block_timeout
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = {}  # {处理器: 尚未汇总的丢弃条数}
+        self.dropped_total = 0
+
+    def put(self, handler, record):
+        """放入一条记录（record为None表示关闭该处理器的文件），放不进队列时计入丢弃数并返回False"""
+        if self.thread is None:
+            self._start()
+        try:
+            if record is None or record.levelno >= logging.WARNING:
+                self.queue.put((handler, record), timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait((handler, record))
+            return True
+        except queue.Full:
+            if record is not None:
+                with self.lock:
+                    self.dropped[handler] = self.dropped.get(handler, 0) + 1
+                    self.dropped_total += 1
+            return False
+
+    def _report_dropped(self):
+        """为丢弃过记录的处理器各写一条汇总，返回写入的处理器和字符数"""
+        with self.lock:
+            dropped, self.dropped = self.dropped, {}
+        written = 0
+        for handler, count in dropped.items():
+            written += handler._write(logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'msg': f"日志队列已满，丢弃了 {count} 条日志（累计 {self.dropped_total} 条）",
+            }))
+        return dropped.keys(), written
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="LogWriter")
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """写完队列中已有的记录后退出"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(self._STOP, timeout=1.0)
+        except queue.Full:
+            return
+        self.thread.join(timeout=5.0)
+
+    def _run(self):
+        dirty = set()  # 有内容尚未flush的处理器
+        pending_bytes = 0
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(last_flush + self.flush_interval - time.monotonic(), 0) if dirty else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                for handler in dirty:
+                    handler._flush_file()
+                return
+            urgent = False
+            if item is not None:
+                handler, record = item
+                if record is None:
+                    handler._close_file()
+                    dirty.discard(handler)
+                else:
+                    pending_bytes += handler._write(record)
+                    dirty.add(handler)
+                    urgent = record.levelno >= logging.ERROR
+            if self.dropped:
+                handlers, written = self._report_dropped()
+                dirty.update(handlers)
+                pending_bytes += written
+            if dirty and (urgent or pending_bytes >= self.flush_size
+                          or time.monotonic() - last_flush >= self.flush_interval):
+                for handler in dirty:
+                    handler._flush_file()
+                dirty.clear()
+                pending_bytes = 0
+                last_flush = time.monotonic()
+
+# 所有TimedRotatingHandler共用一个写入线程
+_log_config = config.get('logging') or {}
+_log_writer = LogWriter(
+    _log_config.get('queue_size', 10000),
+    _log_config.get('flush_interval', 1.0),
+    _log_config.get('flush_size', 65536),
+    _log_config.get('block_timeout', 0.5)
+)
+
 class TimedRotatingHandler(logging.Handler):
-    """自定义处理程序，支持按时间更新日志文件"""
+    """自定义处理程序，支持按时间更新日志文件，记录由LogWriter线程批量写入"""
     def __init__(self, get_filename_func, mode='a', encoding='utf-8'):
         super().__init__()
         self.get_filename_func = get_filename_func
@@ -89,22 +212,51 @@ class TimedRotatingHandler(logging.Handler):
         self.last_time = None
 
     def emit(self, record):
+        _log_writer.put(self, record)
+
+    def _write(self, record):
+        """在写入线程中格式化并写入一条记录，返回写入的字符数"""
         try:
-            current_time = datetime.now().strftime('%Y-%m-%d-%H')
-            
+            current_time = datetime.fromtimestamp(record.created).strftime('%Y-%m-%d-%H')
+
             # 检查是否需要更换文件
             if current_time != self.last_time:
-                if self.current_file:
-                    self.current_file.close()
+                self._close_file()
                 self.current_filename = self.get_filename_func()
-                self.current_file = open(self.current_filename, self.mode, encoding=self.encoding)
+                try:
+                    self.current_file = open(self.current_filename, self.mode, encoding=self.encoding)
+                except FileNotFoundError:
+                    # 日志目录在运行中被删除，清除记录后重新创建
+                    _log_dirs.clear()
+                    self.current_filename = self.get_filename_func()
+                    self.current_file = open(self.current_filename, self.mode, encoding=self.encoding)
                 self.last_time = current_time
 
-            msg = self.format(record)
-            self.current_file.write(msg + '\n')
-            self.current_file.flush()
+            msg = self.format(record) + '\n'
+            self.current_file.write(msg)
+            return len(msg)
         except Exception:
             self.handleError(record)
+            return 0
+
+    def _flush_file(self):
+        try:
+            if self.current_file:
+                self.current_file.flush()
+        except Exception:
+            pass
+
+    def _close_file(self):
+        if self.current_file:
+            self.current_file.close()
+            self.current_file = None
+        self.last_time = None
+
+    def close(self):
+        # 文件由写入线程在写完之前的记录后关闭
+        if _log_writer.thread is not None:
+            _log_writer.put(self, None)
+        super().close()
 
 def setup_logging():
     """设置日志配置"""
@@ -140,19 +292,19 @@ def setup_logging():
     # 添加主程序的日志处理器
     LOGGING_CONFIG['handlers'].update({
         'main_error_file': {
-            'class': '__main__.TimedRotatingHandler',
+            'class': f'{__name__}.TimedRotatingHandler',
             'level': 'ERROR',
             'formatter': 'standard',
             'get_filename_func': lambda: get_log_file_paths()[0],
         },
         'main_print_file': {
-            'class': '__main__.TimedRotatingHandler',
+            'class': f'{__name__}.TimedRotatingHandler',
             'level': 'DEBUG',
             'formatter': 'standard',
             'get_filename_func': lambda: get_log_file_paths()[1],
         },
         'main_warning_file': {
-            'class': '__main__.TimedRotatingHandler',
+            'class': f'{__name__}.TimedRotatingHandler',
             'level': 'WARNING',
             'formatter': 'standard',
             'get_filename_func': lambda: get_log_file_paths()[2],
@@ -167,19 +319,19 @@ def setup_logging():
             # 为每个串口创建独立的处理器
             port_handlers = {
                 f'{port_name}_error_file': {
-                    'class': '__main__.TimedRotatingHandler',
+                    'class': f'{__name__}.TimedRotatingHandler',
                     'level': 'ERROR',
                     'formatter': 'standard',
                     'get_filename_func': lambda p=port_name: get_log_file_paths(p)[0],
                 },
                 f'{port_name}_print_file': {
-                    'class': '__main__.TimedRotatingHandler',
+                    'class': f'{__name__}.TimedRotatingHandler',
                     'level': 'DEBUG',
                     'formatter': 'standard',
                     'get_filename_func': lambda p=port_name: get_log_file_paths(p)[1],
                 },
                 f'{port_name}_warning_file': {
-                    'class': '__main__.TimedRotatingHandler',
+                    'class': f'{__name__}.TimedRotatingHandler',
                     'level': 'WARNING',
                     'formatter': 'standard',
                     'get_filename_func': lambda p=port_name: get_log_file_paths(p)[2],
@@ -208,22 +360,45 @@ def setup_logging():
         'propagate': False
     }
 
+    # Modbus TCP网关的logger配置
+    LOGGING_CONFIG['loggers']['modbus_tcp'] = {
+        'handlers': ['console', 'main_error_file', 'main_print_file', 'main_warning_file'],
+        'level': 'DEBUG',
+        'propagate': False
+    }
+
+    # 串口工作进程的logger配置（工作进程的记录也经此logger写入）
+    LOGGING_CONFIG['loggers']['port_shards'] = {
+        'handlers': ['console', 'main_error_file', 'main_print_file', 'main_warning_file'],
+        'level': 'DEBUG',
+        'propagate': False
+    }
+
     dictConfig(LOGGING_CONFIG)
 
 # 最后设置日志
 setup_logging()
 
 # 设置全局变量
-_server_socket = None
+_server = None
+_server_loop = None
 _is_running = False
+_client_count = 0
 _logger = logging.getLogger(__name__)
 
 # 从配置中获取服务器参数
 host = config['tcp_server']['host']
 port = config['tcp_server']['port']
-max_connections = config['tcp_server']['max_connections']
+# 同时在线的客户端上限，兼容旧配置项max_connections
+max_clients = config['tcp_server'].get('max_clients', config['tcp_server'].get('max_connections', 200))
 buffer_size = config['tcp_server']['buffer_size']
 max_bytes_per_request = config['tcp_server']['max_bytes_per_request']
+# 单个batch请求最多包含的子请求数
+max_batch_size = config['tcp_server'].get('max_batch_size', 100)
+# 推送帧时客户端写缓冲区的上限，超过后丢弃新帧
+push_buffer_limit = config['tcp_server'].get('push_buffer_limit', 1024 * 1024)
+# 新连接默认的分帧方式，客户端可通过hello协商
+default_framing = config['tcp_server'].get('framing', FRAMING_LEGACY)
 
 def find_serial_ports(config_ports):
     """
@@ -277,219 +452,550 @@ def find_serial_ports(config_ports):
     
     return updated_ports
 
-def handle_client(client_socket, client_address):
-    """处理客户端连接"""
-    global _logger, _is_running
-    _logger.info(f"客户端已连接: {client_address}")
-    
-    # 添加缓冲区
-    buffer = b''
-    
+async def _wait_response(future, port_name, timeout):
+    """在事件循环中等待串口请求的应答帧，超时后取消尚未发送的请求"""
     try:
-        client_socket.settimeout(5.0)
-        
-        while _is_running:
-            try:
-                # 接收客户端请求
-                data = client_socket.recv(buffer_size)
-                if not data:
-                    _logger.info(f"客户端断开连接: {client_address}")
-                    break
-                
-                # 将新数据添加到缓冲区
-                buffer += data
-                
-                # 尝试从缓冲区提取完整的JSON消息
-                while True:
-                    # 查找第一个左花括号位置
-                    start = buffer.find(b'{')
-                    if start == -1:
-                        # 没有找到开始标记，清空缓冲区
-                        buffer = b''
-                        break
-                    
-                    # 尝试从这个位置解析一个完整的JSON
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        # Python 3.11起asyncio.TimeoutError就是TimeoutError，发送线程设置的从机无应答等异常也会到这里
+        if future.done() and not future.cancelled():
+            return future.result()  # 请求已完成，返回其结果或抛出其异常
+        if not future.cancelled():
+            # 请求已在总线上发送，无法取消，由发送线程继续完成
+            raise TimeoutError(f"等待串口 {port_name} 应答超时，请求已发送")
+        raise TimeoutError(f"等待串口 {port_name} 应答超时")
+
+def _busy_response(port_name, error):
+    """发送队列已满时的响应，retry_after为建议的重试等待时间（秒）"""
+    handler = serial_manager.serial_ports.get(port_name)
+    retry_after = handler.estimated_wait() if handler else 1.0
+    return {"status": "busy", "message": str(error), "retry_after": round(retry_after, 3), "port": port_name}
+
+async def process_request(request, session):
+    """处理单个客户端请求，返回响应字典"""
+    action = request.get('action')
+    # 可选的发送优先级：high/normal/low，未指定时写请求为high、读请求为normal
+    priority = PRIORITIES.get(request.get('priority'))
+
+    if request.get('priority') is not None and priority is None:
+        response = {"status": "error", "message": f"未知的priority参数: {request.get('priority')}，可选: {', '.join(PRIORITIES)}"}
+
+    elif action == 'hello':
+        # 协商分帧方式，本次响应仍使用原分帧方式
+        framing = request.get('framing', session.framer.name)
+        try:
+            session.next_framer = create_framer(framing, max_bytes_per_request)
+            response = {"status": "success", "framing": framing, "framings": list(FRAMERS)}
+        except ValueError as e:
+            response = {"status": "error", "message": str(e), "framings": list(FRAMERS)}
+
+    elif action == 'batch':
+        # 按顺序执行多个子请求，复用单个请求的处理逻辑
+        sub_requests = request.get('requests')
+        stream = bool(request.get('stream'))
+
+        if not isinstance(sub_requests, list) or not sub_requests:
+            response = {"status": "error", "message": "缺少requests参数"}
+        elif len(sub_requests) > max_batch_size:
+            response = {"status": "error", "message": f"批量请求数超过最大限制: {max_batch_size}"}
+        else:
+            results = []
+            for sub_request in sub_requests:
+                if not isinstance(sub_request, dict):
+                    result = {"status": "error", "message": "子请求必须是JSON对象"}
+                elif sub_request.get('action') in ('batch', 'hello'):
+                    result = {"status": "error", "message": f"批量请求中不支持action: {sub_request.get('action')}"}
+                else:
                     try:
-                        # 使用python的json模块尝试加载部分buffer
-                        # 通过计算嵌套括号来找到正确的JSON结束位置
-                        brace_count = 0
-                        end_pos = start
-                        
-                        for i in range(start, len(buffer)):
-                            if buffer[i] == ord('{'):
-                                brace_count += 1
-                            elif buffer[i] == ord('}'):
-                                brace_count -= 1
-                                
-                            if brace_count == 0:
-                                end_pos = i + 1
-                                break
-                        
-                        if brace_count != 0:
-                            # JSON不完整，等待更多数据
-                            break
-                            
-                        # 提取完整的JSON
-                        json_data = buffer[start:end_pos]
-                        
-                        # 限制接收数据的字节数
-                        if len(json_data) > max_bytes_per_request:
-                            response = {"status": "error", "message": f"接收数据超过最大限制: {max_bytes_per_request} 字节"}
-                            client_socket.send(json.dumps(response).encode('utf-8'))
-                            # 从缓冲区移除这部分数据
-                            buffer = buffer[end_pos:]
-                            continue
-                        
-                        # 解析JSON
-                        request = json.loads(json_data.decode('utf-8'))
-                        _logger.debug(f"收到请求: {request}")
-                        
-                        # 从缓冲区移除已处理的数据
-                        buffer = buffer[end_pos:]
-                        
-                        # 处理请求
-                        if request.get('action') == 'send':
-                            # 发送数据
-                            data_to_send = request.get('data')
-                            port_name = request.get('port')  # 获取串口名称
-
-                            if not data_to_send:
-                                response = {"status": "error", "message": "缺少data参数"}
-                            elif not port_name:
-                                response = {"status": "error", "message": "缺少port参数"}
-                            else:
-                                slave_adress = data_to_send[0]
-                                function_code = data_to_send[1]
-                                start_address = data_to_send[2]
-                                quantity = data_to_send[3]
-                                success = send_data(port_name, slave_adress, function_code, start_address, quantity)
-                                if success:
-                                    response = {"status": "success", "message": f"成功发送数据到串口 {port_name}: {data_to_send}"}
-                                else:
-                                    response = {"status": "error", "message": f"发送数据到串口 {port_name} 失败: {data_to_send}"}
-                            
-                        elif request.get('action') == 'receive':
-                            # 接收数据
-                            num = request.get('num')
-                            port_name = request.get('port')
-                            
-                            if not num:
-                                response = {"status": "error", "message": "缺少num参数"}
-                            elif not port_name:
-                                response = {"status": "error", "message": "缺少port参数"}
-                            else:
-                                handler = serial_manager.serial_ports.get(port_name)
-                                if not handler:
-                                    response = {"status": "error", "message": f"未找到串口 {port_name} 的处理器"}
-                                else:
-                                    try:
-                                        port_logger = logging.getLogger(f"SerialPort_{port_name}")
-                                        frames = get_complete_frames(handler.receive_queue, port_logger, num)
-                                        
-                                        if frames:
-                                            response = {
-                                                "status": "success",
-                                                "frames": frames,
-                                                "port": port_name
-                                            }
-                                        else:
-                                            response = {
-                                                "status": "success",
-                                                "frames": [],
-                                                "port": port_name
-                                            }
-                                        
-                                    except Exception as e:
-                                        _logger.error(f"读取数据帧时出错: {str(e)}")
-                                        response = {"status": "error", "message": str(e)}
-
-                        elif request.get('action') == 'queue_size':
-                            # 获取队列大小
-                            port_name = request.get('port')  # 获取串口名称
-                            
-                            if not port_name:
-                                response = {"status": "error", "message": "缺少port参数"}
-                            else:
-                                size = return_data_num(port_name)
-                                _logger.info(f"串口 {port_name} 当前剩余数据帧个数：{size}")
-                                response = {"status": "success", "size": size, "port": port_name}
-                            
-                        elif request.get('action') == 'clear_queue':
-                            # 清空接收队列
-                            port_name = request.get('port')  # 获取串口名称
-                            
-                            if not port_name:
-                                response = {"status": "error", "message": "缺少port参数"}
-                            else:
-                                clear_receive_queue(port_name)
-                                response = {"status": "success", "message": f"串口 {port_name} 的接收队列已清空"}
-
-                        elif request.get('action') == 'status':
-                            # 获取所有串口状态
-                            ports_status = {}
-                            for port_name in serial_manager.serial_ports:
-                                handler = serial_manager.serial_ports[port_name]
-                                ports_status[port_name] = {
-                                    "connected": handler.is_connected,
-                                    "queue_size": handler.receive_queue.length()
-                                }
-                            response = {
-                                "status": "success", 
-                                "server_running": _is_running,
-                                "ports": ports_status
-                            }
-
-                        else:
-                            response = {"status": "error", "message": f"未知的action参数: {request.get('action')}"}
-                            
-                        # 发送响应
-                        _logger.debug(f"发送响应: {response}")
-                        client_socket.send(json.dumps(response).encode('utf-8'))
-                        
-                    except json.JSONDecodeError:
-                        # 尝试找下一个可能的起始位置
-                        next_start = buffer.find(b'{', start + 1)
-                        if next_start == -1:
-                            # 没有更多可能的JSON开始，保留当前缓冲区等待更多数据
-                            break
-                        else:
-                            # 丢弃无效部分，从下一个可能的JSON开始位置继续
-                            buffer = buffer[next_start:]
+                        result = await process_request(sub_request, session)
                     except Exception as e:
-                        _logger.error(f"处理请求时出错: {str(e)}")
-                        # 出错时，尝试继续处理下一个可能的JSON
-                        next_start = buffer.find(b'{', start + 1)
-                        if next_start == -1:
-                            # 没有更多可能的JSON开始，清空缓冲区
-                            buffer = b''
-                            break
-                        else:
-                            # 从下一个可能的JSON开始
-                            buffer = buffer[next_start:]
-                
-            except socket.timeout:
-                # 接收超时，继续循环
-                continue
+                        _logger.error(f"处理批量子请求时出错: {str(e)}")
+                        result = {"status": "error", "message": str(e)}
+                if isinstance(sub_request, dict) and 'id' in sub_request:
+                    result['id'] = sub_request['id']
+
+                if stream:
+                    # 逐个推送子请求的响应
+                    session.send(result)
+                    await session.writer.drain()
+                else:
+                    results.append(result)
+
+            if stream:
+                response = {"status": "success", "action": "batch_end", "count": len(sub_requests)}
+            else:
+                response = {"status": "success", "results": results}
+
+    elif action == 'subscribe':
+        # 订阅串口帧推送，可按从机地址和功能码过滤
+        port_names = request.get('ports') or ([request['port']] if request.get('port') else [])
+        slaves = request.get('slaves') or ([request['slave']] if request.get('slave') is not None else None)
+        function_codes = request.get('function_codes') or (
+            [request['function_code']] if request.get('function_code') is not None else None)
+
+        if not port_names:
+            response = {"status": "error", "message": "缺少port参数"}
+        else:
+            try:
+                for port_name in port_names:
+                    session.subscribe(port_name, slaves, function_codes)
+                response = {"status": "success", "subscribed": sorted(session.subscriptions)}
+            except KeyError as e:
+                response = {"status": "error", "message": e.args[0], "subscribed": sorted(session.subscriptions)}
+
+    elif action == 'unsubscribe':
+        # 取消订阅，未指定串口时取消全部
+        port_names = request.get('ports') or ([request['port']] if request.get('port') else None)
+        if port_names is None:
+            session.unsubscribe_all()
+        else:
+            for port_name in port_names:
+                session.unsubscribe(port_name)
+        response = {"status": "success", "subscribed": sorted(session.subscriptions)}
+
+    elif action == 'send':
+        # 发送数据
+        data_to_send = request.get('data')
+        port_name = request.get('port')  # 获取串口名称
+
+        if not data_to_send:
+            response = {"status": "error", "message": "缺少data参数"}
+        elif not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        else:
+            slave_adress = data_to_send[0]
+            function_code = data_to_send[1]
+            start_address = data_to_send[2]
+            quantity = data_to_send[3]
+            try:
+                success = send_data(port_name, slave_adress, function_code, start_address, quantity, priority)
+                if success:
+                    response = {"status": "success", "message": f"成功发送数据到串口 {port_name}: {data_to_send}"}
+                else:
+                    response = {"status": "error", "message": f"发送数据到串口 {port_name} 失败: {data_to_send}"}
+            except queue.Full as e:
+                response = _busy_response(port_name, e)
+
+    elif action == 'query':
+        # 发送请求并等待应答，等待期间不占用事件循环
+        data_to_send = request.get('data')
+        port_name = request.get('port')
+
+        if not data_to_send:
+            response = {"status": "error", "message": "缺少data参数"}
+        elif not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        else:
+            timeout = request.get('timeout') or config['modbus'].get('query_timeout', 10.0)
+            try:
+                future = submit_query(port_name, *data_to_send[:4], priority=priority)
+                frame = await _wait_response(future, port_name, timeout)
+                response = {
+                    "status": "success",
+                    "frame": frame.hex() if frame else None,
+                    "port": port_name
+                }
+                if frame and frame[1] & 0x80:
+                    response["exception_code"] = frame[2]
+            except queue.Full as e:
+                response = _busy_response(port_name, e)
+            except Exception as e:
+                response = {"status": "error", "message": str(e), "port": port_name}
+
+    elif action == 'write':
+        # 写线圈/寄存器：data为[从机地址, 功能码(5/6/15/16), 起始地址, 值或值列表]
+        data_to_send = request.get('data')
+        port_name = request.get('port')
+
+        if not data_to_send or len(data_to_send) < 4:
+            response = {"status": "error", "message": "缺少data参数"}
+        elif not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        else:
+            timeout = request.get('timeout') or config['modbus'].get('query_timeout', 10.0)
+            try:
+                future = submit_write(port_name, *data_to_send[:4], priority=priority)
+                frame = await _wait_response(future, port_name, timeout)
+                response = {
+                    "status": "success",
+                    "frame": frame.hex() if frame else None,
+                    "port": port_name
+                }
+                if frame and frame[1] & 0x80:
+                    response["exception_code"] = frame[2]
+            except queue.Full as e:
+                response = _busy_response(port_name, e)
             except Exception as e:
-                _logger.error(f"处理客户端请求时出错: {str(e)}")
+                response = {"status": "error", "message": str(e), "port": port_name}
+
+    elif action == 'read_cached':
+        # 缓存值足够新时直接返回，否则发起一次总线读取
+        data_to_send = request.get('data')
+        port_name = request.get('port')
+
+        if not data_to_send or len(data_to_send) < 4:
+            response = {"status": "error", "message": "缺少data参数"}
+        elif not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        elif not data_to_send[0] or data_to_send[3] <= 0:
+            response = {"status": "error", "message": "read_cached不支持广播地址，数量必须大于0"}
+        else:
+            slave_adress, function_code, start_address, quantity = data_to_send[:4]
+            max_age = request.get('max_age', config['modbus'].get('cache_max_age', 1.0))
+            timeout = request.get('timeout') or config['modbus'].get('query_timeout', 10.0)
+            try:
+                cached = read_cached(port_name, slave_adress, function_code, start_address, quantity, max_age)
+                if cached:
+                    values, timestamp = cached
+                    response = {"status": "success", "values": values, "timestamp": timestamp, "cached": True, "port": port_name}
+                else:
+                    future = submit_query(port_name, slave_adress, function_code, start_address, quantity, priority)
+                    frame = await _wait_response(future, port_name, timeout)
+                    if frame[1] & 0x80:
+                        response = {"status": "error", "message": f"从机返回异常应答: {frame.hex()}",
+                                    "exception_code": frame[2], "port": port_name}
+                    else:
+                        response = {
+                            "status": "success",
+                            "values": decode_values(function_code, frame, quantity),
+                            "timestamp": time.time(),
+                            "cached": False,
+                            "port": port_name
+                        }
+            except queue.Full as e:
+                response = _busy_response(port_name, e)
+            except Exception as e:
+                response = {"status": "error", "message": str(e), "port": port_name}
+
+    elif action == 'receive':
+        # 接收数据
+        num = request.get('num')
+        port_name = request.get('port')
+
+        if not num:
+            response = {"status": "error", "message": "缺少num参数"}
+        elif not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        else:
+            handler = serial_manager.serial_ports.get(port_name)
+            if not handler:
+                response = {"status": "error", "message": f"未找到串口 {port_name} 的处理器"}
+            else:
                 try:
-                    error_response = {"status": "error", "message": str(e)}
-                    client_socket.send(json.dumps(error_response).encode('utf-8'))
-                except:
-                    pass
+                    # 指定since_seq时从该序号读取，否则从本连接自己的游标读取
+                    since_seq = request.get('since_seq')
+                    if since_seq is None:
+                        since_seq = session.cursor(port_name)
+                    port_logger = logging.getLogger(f"SerialPort_{port_name}")
+                    frames, first_seq, next_seq = get_complete_frames(handler.frame_log, port_logger, num, since_seq)
+                    session.cursors[port_name] = next_seq
+                    response = {
+                        "status": "success",
+                        "frames": frames,
+                        "port": port_name,
+                        "first_seq": first_seq,
+                        "next_seq": next_seq,
+                        "lost": max(first_seq - since_seq, 0)
+                    }
+                except Exception as e:
+                    _logger.error(f"读取数据帧时出错: {str(e)}")
+                    response = {"status": "error", "message": str(e)}
+
+    elif action == 'queue_size':
+        # 获取队列大小
+        port_name = request.get('port')  # 获取串口名称
+
+        if not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        else:
+            since_seq = request.get('since_seq')
+            size = return_data_num(port_name, session.cursor(port_name) if since_seq is None else since_seq)
+            _logger.info(f"串口 {port_name} 当前剩余数据帧个数：{size}")
+            response = {"status": "success", "size": size, "port": port_name}
+
+    elif action == 'clear_queue':
+        # 跳过本连接尚未读取的帧；all为true时清空串口的接收缓冲区和帧日志（影响所有客户端）
+        port_name = request.get('port')  # 获取串口名称
+
+        if not port_name:
+            response = {"status": "error", "message": "缺少port参数"}
+        elif request.get('all'):
+            clear_receive_queue(port_name)
+            response = {"status": "success", "message": f"串口 {port_name} 的接收队列已清空"}
+        else:
+            handler = serial_manager.serial_ports.get(port_name)
+            if handler:
+                session.cursors[port_name] = handler.frame_log.next_seq
+            response = {"status": "success", "message": f"串口 {port_name} 的接收队列已清空"}
+
+    elif action == 'status':
+        # 获取所有串口状态
+        ports_status = {}
+        for port_name in serial_manager.serial_ports:
+            handler = serial_manager.serial_ports[port_name]
+            ports_status[port_name] = {
+                "connected": handler.is_connected,
+                "queue_size": handler.frame_log.length(),
+                "next_seq": handler.frame_log.next_seq,
+                "cache_size": handler.register_cache.size(),
+                "cache_hits": handler.register_cache.hit_count,
+                "cache_misses": handler.register_cache.miss_count,
+                **handler.stats()
+            }
+            if handler.poll_scheduler:
+                ports_status[port_name]["missed_deadlines"] = handler.poll_scheduler.missed_count()
+                ports_status[port_name]["polls"] = handler.poll_scheduler.status()
+        response = {
+            "status": "success",
+            "server_running": _is_running,
+            "clients": _client_count,
+            "ports": ports_status
+        }
+
+    else:
+        response = {"status": "error", "message": f"未知的action参数: {action}"}
+
+    return response
+
+class FrameSubscription:
+    """客户端对单个串口的帧订阅，在接收线程中过滤后转交事件循环推送"""
+    def __init__(self, session, port_name, slaves=None, function_codes=None):
+        self.session = session
+        self.port_name = port_name
+        self.slaves = set(slaves) if slaves else None
+        self.function_codes = set(function_codes) if function_codes else None
+
+    def __call__(self, port_name, seq, timestamp, frame):
+        if self.slaves and frame[0] not in self.slaves:
+            return
+        if self.function_codes and frame[1] & 0x7F not in self.function_codes:
+            return
+        self.session.loop.call_soon_threadsafe(self.session.push_frame, port_name, seq, timestamp, frame)
+
+class ClientSession:
+    """单个客户端连接的状态"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.address = writer.get_extra_info('peername')
+        self.framer = create_framer(default_framing, max_bytes_per_request)
+        # hello协商后，在本次响应发出后切换到的分帧方式
+        self.next_framer = None
+        # 帧订阅 {port_name: FrameSubscription}
+        self.subscriptions = {}
+        self.dropped_frames = 0
+        # 各串口帧日志的读取游标，从日志中最早的帧开始：
+        # 客户端常在一个连接上发送、另一个新连接上receive，连接建立前收到的应答也要能读到
+        self.cursors = {
+            port_name: handler.frame_log.first_seq()
+            for port_name, handler in serial_manager.serial_ports.items()
+        }
+
+    def cursor(self, port_name):
+        """本连接在指定串口上的读取游标"""
+        if port_name not in self.cursors:
+            handler = serial_manager.serial_ports.get(port_name)
+            return handler.frame_log.first_seq() if handler else 0
+        return self.cursors[port_name]
+
+    def subscribe(self, port_name, slaves=None, function_codes=None):
+        """订阅串口的帧推送，重复订阅时更新过滤条件
+        Raises:
+            KeyError: 未找到串口处理器
+        """
+        handler = serial_manager.serial_ports.get(port_name)
+        if not handler:
+            raise KeyError(f"未找到串口 {port_name} 的处理器")
+        self.unsubscribe(port_name)
+        subscription = FrameSubscription(self, port_name, slaves, function_codes)
+        self.subscriptions[port_name] = subscription
+        handler.add_frame_listener(subscription)
+
+    def unsubscribe(self, port_name):
+        """取消串口的帧推送"""
+        subscription = self.subscriptions.pop(port_name, None)
+        handler = serial_manager.serial_ports.get(port_name)
+        if subscription and handler:
+            handler.remove_frame_listener(subscription)
+
+    def unsubscribe_all(self):
+        for port_name in list(self.subscriptions):
+            self.unsubscribe(port_name)
+
+    def push_frame(self, port_name, seq, timestamp, frame):
+        """推送订阅的帧（在事件循环中执行），客户端读取过慢时丢弃"""
+        if port_name not in self.subscriptions or self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > push_buffer_limit:
+            self.dropped_frames += 1
+            if self.dropped_frames % 100 == 1:
+                _logger.warning(f"客户端 {self.address} 接收过慢，已丢弃 {self.dropped_frames} 个推送帧")
+            return
+        self.writer.write(self.framer.encode({
+            "action": "frame",
+            "port": port_name,
+            "seq": seq,
+            "frame": frame.hex(),
+            "timestamp": timestamp
+        }))
+
+    def send(self, message):
+        """按当前分帧方式写出一条消息（由调用方负责drain）"""
+        _logger.debug(f"发送响应: {message}")
+        self.writer.write(self.framer.encode(message))
+
+    def switch_framing(self):
+        """切换到协商后的分帧方式，未处理的数据交给新的分帧器"""
+        if self.next_framer is not None:
+            self.next_framer.feed(self.framer.detach())
+            self.framer = self.next_framer
+            self.next_framer = None
+
+async def handle_client(reader, writer):
+    """处理客户端连接（协程，所有客户端共用一个事件循环）"""
+    global _client_count
+    session = ClientSession(reader, writer)
+    client_address = session.address
+
+    # 超过连接上限时直接拒绝
+    if _client_count >= max_clients:
+        _logger.warning(f"连接数已达上限 {max_clients}，拒绝客户端: {client_address}")
+        session.send({"status": "error", "message": f"连接数已达上限: {max_clients}"})
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        return
+
+    _client_count += 1
+    _logger.info(f"客户端已连接: {client_address}")
+
+    try:
+        while _is_running:
+            # 接收客户端请求
+            data = await reader.read(buffer_size)
+            if not data:
+                _logger.info(f"客户端断开连接: {client_address}")
                 break
-                
+
+            session.framer.feed(data)
+
+            # 依次处理缓冲区中的完整消息，超长消息在接收完之前即被拒绝
+            while True:
+                try:
+                    request = session.framer.next_message()
+                except FrameError as e:
+                    _logger.warning(f"无法解析的请求: {client_address}, {e}")
+                    session.send({"status": "error", "message": str(e)})
+                    continue
+                if request is None:
+                    break
+                if not isinstance(request, dict):
+                    session.send({"status": "error", "message": "请求必须是JSON对象"})
+                    continue
+
+                _logger.debug(f"收到请求: {request}")
+                try:
+                    response = await process_request(request, session)
+                except Exception as e:
+                    _logger.error(f"处理请求时出错: {str(e)}")
+                    response = {"status": "error", "message": str(e)}
+
+                # 回传客户端提供的请求id，便于流水线请求匹配响应
+                if 'id' in request:
+                    response['id'] = request['id']
+                session.send(response)
+                session.switch_framing()
+
+            await writer.drain()
+
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        _logger.info(f"客户端连接中断: {client_address}, {e}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _logger.error(f"处理客户端请求时出错: {str(e)}")
+        try:
+            session.send({"status": "error", "message": str(e)})
+            await writer.drain()
+        except Exception:
+            pass
+
     finally:
         # 关闭客户端连接
+        _client_count -= 1
+        session.unsubscribe_all()
         try:
-            client_socket.close()
-        except:
+            writer.close()
+        except Exception:
             pass
         _logger.info(f"客户端连接已关闭: {client_address}")
 
+async def _serve():
+    """在事件循环中运行TCP服务器，直到stop_server被调用"""
+    global _server, _server_loop, _is_running
+    _server_loop = asyncio.get_running_loop()
+    try:
+        _server = await asyncio.start_server(
+            handle_client, host, port,
+            reuse_address=True,
+            backlog=max_clients
+        )
+    except OSError as e:
+        _logger.error(f"绑定地址 {host}:{port} 失败: {str(e)}")
+        return False
+
+    gateway = await _start_modbus_tcp()
+
+    _is_running = True
+    _logger.info(f"TCP服务器已启动，监听 {host}:{port}，最大连接数 {max_clients}")
+    try:
+        async with _server:
+            await _server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if gateway is not None:
+            gateway.close()
+    return True
+
+async def _start_modbus_tcp():
+    """按modbus_tcp配置启动Modbus TCP网关，未启用或启动失败时返回None"""
+    gateway_config = config.get('modbus_tcp') or {}
+    if not gateway_config.get('enabled'):
+        return None
+    started_ports = [port_config for port_config in config['serial_ports']
+                     if port_config.get('name') in serial_manager.serial_ports]
+    default_port = gateway_config.get('default_port')
+    if not default_port and len(started_ports) == 1:
+        default_port = started_ports[0]['name']
+    gateway = ModbusTcpGateway(
+        build_unit_map(started_ports),
+        default_port,
+        max_outstanding=gateway_config.get('max_outstanding', 16),
+        max_clients=gateway_config.get('max_clients', 50),
+        timeout=config['modbus'].get('query_timeout', 10.0)
+    )
+    gateway_host = gateway_config.get('host', host)
+    gateway_port = gateway_config.get('port', 502)
+    try:
+        await gateway.start(gateway_host, gateway_port)
+    except OSError as e:
+        _logger.error(f"Modbus TCP网关绑定地址 {gateway_host}:{gateway_port} 失败: {str(e)}")
+        return None
+    return gateway
+
+def stop_server():
+    """停止TCP服务器（可在其他线程调用）"""
+    global _is_running
+    _is_running = False
+    if _server is not None and _server_loop is not None and not _server_loop.is_closed():
+        _server_loop.call_soon_threadsafe(_server.close)
+
 def start_server():
     """启动TCP服务器"""
-    global _server_socket, _is_running, _logger, config
+    global _is_running, _logger, config
 
     # 启动多个串口服务
     serial_ports = config.get('serial_ports', [])
@@ -517,9 +1023,14 @@ def start_server():
             continue
             
         try:
-            if start_serial_process(com=port_name, baudrate=baudrate):
+            if start_serial_process(com=port_name, baudrate=baudrate, slaves=port_config.get('slaves')):
                 _logger.info(f"成功启动串口 {port_name}, 波特率 {baudrate}")
                 success_count += 1
+                if port_config.get('polls'):
+                    try:
+                        start_polling(port_name, port_config['polls'])
+                    except (KeyError, ValueError) as e:
+                        _logger.error(f"串口 {port_name} 轮询表配置错误: {e}")
             else:
                 _logger.error(f"启动串口失败: {port_name}")
         except Exception as e:
@@ -532,80 +1043,25 @@ def start_server():
         _logger.info(f"成功启动 {success_count} 个串口")
 
     try:
-        # 创建TCP套接字
-        _server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        _server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
-        try:
-            _server_socket.bind((host, port))
-        except socket.error as e:
-            _logger.error(f"绑定地址 {host}:{port} 失败: {str(e)}")
-            _server_socket.close()
-            return False
-            
-        _server_socket.listen(max_connections)
-        _server_socket.settimeout(1.0)
-        _is_running = True
-        _logger.info(f"TCP服务器已启动，监听 {host}:{port}")
-
-        while _is_running:
-            try:
-                client_socket, client_address = _server_socket.accept()
-                client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
-                client_thread.daemon = True
-                client_thread.start()
-                
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if _is_running:
-                    _logger.error(f"接受客户端连接时出错: {str(e)}")
-                    # 尝试重新创建socket并监听
-                    try:
-                        _server_socket.close()
-                        _server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        _server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                        _server_socket.bind((host, port))
-                        _server_socket.listen(max_connections)
-                        _server_socket.settimeout(1.0)
-                        _logger.info("TCP服务器已重新启动")
-                    except Exception as e2:
-                        _logger.error(f"重启TCP服务器失败: {str(e2)}")
-                        _is_running = False
-                        break
-
+        return asyncio.run(_serve())
     except Exception as e:
         _logger.error(f"启动TCP服务器时出错: {str(e)}")
-        if _server_socket:
-            try:
-                _server_socket.close()
-            except:
-                pass
         return False
     finally:
-        if _server_socket:
-            try:
-                _server_socket.close()
-            except:
-                pass
         _is_running = False
 
 if __name__ == '__main__':
+    # 打包后的程序启动串口工作进程时需要
+    multiprocessing.freeze_support()
     _logger.info("正在启动串口TCP服务器...")
     
     try:
-        if start_server():
-            while _is_running:
-                time.sleep(1)
+        start_server()
     except KeyboardInterrupt:
         _logger.info("收到退出信号，正在关闭服务器...")
     except Exception as e:
         _logger.error(f"服务器运行时出错: {str(e)}")
     finally:
-        _is_running = False
-        if _server_socket:
-            try:
-                _server_socket.close()
-            except:
-                pass
-        _logger.info("串口TCP服务器已退出") 
+        stop_server()
+        stop_shards()
+        _logger.info("串口TCP服务器已退出")
@@ -0,0 +1,204 @@
+# 基于asyncio的串口收发引擎：所有串口共用一个事件循环线程，每个串口一个发送协程
+
+import asyncio
+import queue
+import sys
+import threading
+import time
+from serial_serve import SerialHandler, CoalescedRead, CoalescedWrite, config
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_serial_loop():
+    """返回串口共用的事件循环，首次调用时在后台线程中启动"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="SerialEventLoop")
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+class AsyncSerialHandler(SerialHandler):
+    """
+    事件循环驱动的串口处理类
+    - Linux下用add_reader监听串口文件描述符，数据到达即在事件循环中读取并解析
+    - 不支持文件描述符监听的平台（Windows）退回为按serial.receive_time间隔轮询
+    - 发送协程在请求入队时被唤醒，总线静默等待和应答等待都不占用线程
+    - 解析、应答匹配和请求发送都在事件循环线程中执行
+    """
+    def __init__(self, port_name, baudrate, timeout=1, slaves=None):
+        super().__init__(port_name, baudrate, timeout, slaves)
+        self.loop = None
+        self.request_ready = None
+        self.response_ready = None
+        self.tasks = []
+        self.reader_fd = None
+
+    def _start_threads(self):
+        """在共用事件循环中启动本串口的收发协程（替代收发线程）"""
+        self.serial_port.timeout = 0  # 非阻塞读取
+        self.loop = get_serial_loop()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self):
+        self.request_ready = asyncio.Event()
+        self.response_ready = asyncio.Event()
+        self.send_queue.on_put = self._wake_sender
+        self.tasks.append(asyncio.create_task(self._send_loop()))
+        if not self._add_reader():
+            self.tasks.append(asyncio.create_task(self._poll_loop()))
+        self.logger.info(f"串口{self.port_name}已加入事件循环（{'fd监听' if self.reader_fd is not None else '轮询'}）")
+
+    def _add_reader(self):
+        """注册串口文件描述符的可读回调，平台不支持时返回False"""
+        if sys.platform == 'win32' or not hasattr(self.serial_port, 'fileno'):
+            return False
+        try:
+            fd = self.serial_port.fileno()
+            self.loop.add_reader(fd, self._on_readable)
+        except (OSError, NotImplementedError, ValueError):
+            return False
+        self.reader_fd = fd
+        return True
+
+    def _wake_sender(self):
+        """发送队列入队回调，可能在任意线程调用"""
+        self.loop.call_soon_threadsafe(self.request_ready.set)
+
+    def _on_readable(self):
+        """串口有数据可读"""
+        try:
+            data = self.serial_port.read(self.serial_port.in_waiting or 1)
+            if data:
+                self._receive(data)
+        except Exception as e:
+            if not self.is_connected:
+                return
+            # 串口异常时暂停监听，稍后重试
+            self.logger.error(f"接收数据错误: {e}")
+            self.loop.remove_reader(self.reader_fd)
+            self.loop.call_later(config['serial']['receive_error_time'], self._resume_reader)
+
+    def _resume_reader(self):
+        if self.is_connected:
+            self.loop.add_reader(self.reader_fd, self._on_readable)
+
+    async def _poll_loop(self):
+        """轮询接收（不支持fd监听的平台）"""
+        interval = config['serial']['receive_time']
+        while self.is_connected:
+            try:
+                waiting = self.serial_port.in_waiting
+                if waiting:
+                    self._receive(self.serial_port.read(waiting))
+                else:
+                    await asyncio.sleep(interval)
+            except Exception as e:
+                if not self.is_connected:
+                    break
+                self.logger.error(f"接收数据错误: {e}")
+                await asyncio.sleep(config['serial']['receive_error_time'])
+
+    def _receive(self, data):
+        """处理读到的数据，接收缓冲区满时先腾出空间"""
+        self._handle_received(data)
+        if self.receive_queue.is_paused():
+            self.logger.info("接收队列已满，开始处理队列中的数据")
+            self._process_full_queue()
+            if self.temp_buffer and not self.receive_queue.is_paused():
+                self._process_temp_buffer()
+
+    def _on_frame(self, frame):
+        frames = super()._on_frame(frame)
+        if self.response_event.is_set():
+            self.response_ready.set()
+        return frames
+
+    async def _send_loop(self):
+        """发送协程：逐个取出请求完成事务"""
+        self.logger.info(f"串口{self.port_name}发送协程已启动")
+        while self.is_connected:
+            try:
+                try:
+                    request = self.send_queue.get(timeout=0)
+                except queue.Empty:
+                    self.request_ready.clear()
+                    if not self.send_queue.qsize():
+                        await self.request_ready.wait()
+                    continue
+                request = self._coalesce(request)
+                if request is None or not request.future.set_running_or_notify_cancel():
+                    continue
+                started = time.monotonic()
+                resend = ()
+                try:
+                    await self._exchange_async(request)
+                finally:
+                    # 事务出错或协程被取消时也要让合并的原请求全部完成
+                    if isinstance(request, (CoalescedRead, CoalescedWrite)):
+                        resend = self._complete_parts(request)
+                self.transaction_time += (time.monotonic() - started - self.transaction_time) * 0.2
+                for part in resend:
+                    await self._exchange_async(part)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"发送协程错误: {e}")
+                await asyncio.sleep(config['serial']['send_error_time'])
+
+    async def _send_async(self, request):
+        """等待总线静默后写出请求帧"""
+        frame = self._prepare_frame(request)
+        if frame is None:
+            return False
+        delay = self._bus_idle_delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._bus_idle_delay()
+        return self._write_frame(frame)
+
+    async def _exchange_async(self, request):
+        """_exchange的协程版本"""
+        attempts = self._begin_exchange(request)
+        if not attempts:
+            return
+        if request.slave_adress == 0:
+            if await self._send_async(request):
+                request.future.set_result(None)
+            else:
+                self._send_failed(request)
+            return
+
+        response_timeout = config['modbus'].get('response_timeout', 1.0)
+        for attempt in range(1, attempts + 1):
+            self._arm(request, attempt)
+            self.response_ready.clear()
+            if not await self._send_async(request):
+                self._send_failed(request)
+                return
+            try:
+                await asyncio.wait_for(self.response_ready.wait(), response_timeout)
+                self._complete(request)
+                return
+            except asyncio.TimeoutError:
+                if self._timed_out(request, attempt, attempts):
+                    break
+        self._give_up(request)
+
+    def disconnect(self):
+        """断开串口连接并移出事件循环"""
+        if self.loop is not None and self.is_connected:
+            asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        return super().disconnect()
+
+    async def _stop(self):
+        if self.reader_fd is not None:
+            self.loop.remove_reader(self.reader_fd)
+            self.reader_fd = None
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.send_queue.on_put = None
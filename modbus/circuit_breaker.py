@@ -0,0 +1,122 @@
+# 按从机地址的熔断器：连续无应答的从机暂停发送，按退避间隔探测恢复
+
+import threading
+import time
+
+# 熔断状态
+STATE_CLOSED = 'closed'        # 正常发送
+STATE_OPEN = 'open'            # 熔断中，请求直接失败
+STATE_HALF_OPEN = 'half_open'  # 退避时间已到，放行一个探测请求
+
+class SlaveState:
+    """单个从机的熔断状态"""
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.failures = 0      # 连续无应答次数
+        self.backoff = 0.0     # 当前退避间隔（秒）
+        self.open_until = 0.0  # 熔断结束时刻（monotonic）
+        self.trip_count = 0    # 累计熔断次数
+
+class CircuitBreaker:
+    """
+    单个串口上各从机的熔断器
+    - 连续threshold次无应答后熔断，熔断期间该从机的请求不再占用总线
+    - 退避时间到后放行一个探测请求：成功则恢复，失败则退避时间加倍（不超过max_backoff），未能发出则下次重新探测
+    - threshold为0时不熔断
+    """
+    def __init__(self, threshold, backoff, max_backoff):
+        self.threshold = threshold
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.slaves = {}
+        self.lock = threading.Lock()
+
+    def is_open(self, slave_adress):
+        """从机处于熔断中且未到探测时间"""
+        with self.lock:
+            slave = self.slaves.get(slave_adress)
+            return slave is not None and slave.state == STATE_OPEN and time.monotonic() < slave.open_until
+
+    def allow(self, slave_adress):
+        """
+        判断是否可以向从机发送请求
+        Returns:
+            str: 可以发送时返回当前状态（closed或half_open），不可发送时返回None
+        """
+        with self.lock:
+            slave = self.slaves.get(slave_adress)
+            if slave is None or slave.state == STATE_CLOSED:
+                return STATE_CLOSED
+            if slave.state == STATE_OPEN and time.monotonic() >= slave.open_until:
+                slave.state = STATE_HALF_OPEN
+                return STATE_HALF_OPEN
+            return None
+
+    def record_success(self, slave_adress):
+        """从机有应答（包括异常应答）"""
+        with self.lock:
+            slave = self.slaves.get(slave_adress)
+            if slave is None:
+                return False
+            recovered = slave.state != STATE_CLOSED
+            slave.state = STATE_CLOSED
+            slave.failures = 0
+            slave.backoff = 0.0
+            return recovered
+
+    def record_failure(self, slave_adress):
+        """
+        从机无应答
+        Returns:
+            bool: 本次失败导致熔断（或探测失败后继续熔断）时返回True
+        """
+        if not self.threshold:
+            return False
+        with self.lock:
+            slave = self.slaves.setdefault(slave_adress, SlaveState())
+            slave.failures += 1
+            if slave.state == STATE_HALF_OPEN:
+                slave.backoff = min(slave.backoff * 2, self.max_backoff)
+            elif slave.failures >= self.threshold:
+                slave.backoff = self.initial_backoff
+                slave.trip_count += 1
+            else:
+                return False
+            slave.state = STATE_OPEN
+            slave.open_until = time.monotonic() + slave.backoff
+            return True
+
+    def release(self, slave_adress):
+        """
+        探测请求未能发出（发送失败）时调用：回到熔断状态且不加倍退避，下次allow时重新探测
+        Returns:
+            bool: 从机处于半开状态并已回到熔断状态时返回True
+        """
+        with self.lock:
+            slave = self.slaves.get(slave_adress)
+            if slave is None or slave.state != STATE_HALF_OPEN:
+                return False
+            slave.state = STATE_OPEN
+            return True
+
+    def retry_in(self, slave_adress):
+        """距离下次探测的秒数"""
+        with self.lock:
+            slave = self.slaves.get(slave_adress)
+            if slave is None or slave.state != STATE_OPEN:
+                return 0.0
+            return max(slave.open_until - time.monotonic(), 0.0)
+
+    def status(self):
+        """记录过无应答的从机状态 {从机地址: {...}}"""
+        now = time.monotonic()
+        with self.lock:
+            return {
+                slave_adress: {
+                    "state": slave.state,
+                    "failures": slave.failures,
+                    "trips": slave.trip_count,
+                    "retry_in": round(max(slave.open_until - now, 0.0), 3) if slave.state == STATE_OPEN else 0.0
+                }
+                for slave_adress, slave in self.slaves.items()
+            }
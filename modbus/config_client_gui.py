@@ -10,6 +10,8 @@ import os
 import socket
 import json
 import serial.tools.list_ports
+from crc import verify_frame
+from tcp_framing import create_framer, FRAMING_LEGACY, FRAMING_NDJSON
 
 class ConfigClientGUI(QMainWindow):
     def __init__(self):
@@ -27,6 +29,7 @@ class ConfigClientGUI(QMainWindow):
         self.is_connected = False
         self.client_socket = None
         self.is_continuous_sending = False
+        self.framer = create_framer(FRAMING_LEGACY)
         self.send_timer = QTimer()
         self.send_timer.timeout.connect(self.send_client_request)
 
@@ -106,7 +109,7 @@ class ConfigClientGUI(QMainWindow):
         self.config['tcp_server']['buffer_size'] = int(self.buffer_size.text())
         self.config['tcp_server']['host'] = self.tcp_host.text()
         self.config['tcp_server']['port'] = int(self.tcp_port.text())
-        self.config['tcp_server']['max_connections'] = int(self.max_connections.text())
+        self.config['tcp_server']['max_clients'] = int(self.max_clients.text())
         
         # 保存到文件
         with open('config.yaml', 'w', encoding='utf-8') as file:
@@ -127,7 +130,7 @@ class ConfigClientGUI(QMainWindow):
         self.serial_send_error_time = QLineEdit(str(self.config['serial']['send_error_time']))
         self.serial_receive_error_time = QLineEdit(str(self.config['serial']['receive_error_time']))
         
-        serial_layout.addWidget(QLabel("发送间隔时间:"))
+        serial_layout.addWidget(QLabel("额外发送间隔时间(在t3.5静默间隔之外):"))
         serial_layout.addWidget(self.serial_send_time)
         serial_layout.addWidget(QLabel("接收间隔时间:"))
         serial_layout.addWidget(self.serial_receive_time)
@@ -146,14 +149,14 @@ class ConfigClientGUI(QMainWindow):
         self.buffer_size = QLineEdit(str(self.config['tcp_server']['buffer_size']))
         self.tcp_host = QLineEdit(self.config['tcp_server']['host'])
         self.tcp_port = QLineEdit(str(self.config['tcp_server']['port']))
-        self.max_connections = QLineEdit(str(self.config['tcp_server']['max_connections']))
+        self.max_clients = QLineEdit(str(self.config['tcp_server'].get('max_clients', self.config['tcp_server'].get('max_connections', 200))))
         
         tcp_layout.addWidget(QLabel("TCP地址:"))
         tcp_layout.addWidget(self.tcp_host)
         tcp_layout.addWidget(QLabel("TCP端口:"))
         tcp_layout.addWidget(self.tcp_port)
         tcp_layout.addWidget(QLabel("最大连接数:"))
-        tcp_layout.addWidget(self.max_connections)
+        tcp_layout.addWidget(self.max_clients)
         tcp_layout.addWidget(QLabel("缓冲区大小:"))
         tcp_layout.addWidget(self.buffer_size)
         
@@ -188,7 +191,7 @@ class ConfigClientGUI(QMainWindow):
         action_layout = QHBoxLayout()
         
         self.action_combo = QComboBox()
-        self.action_combo.addItems(['send', 'receive', 'queue_size', 'status', 'clear_queue'])
+        self.action_combo.addItems(['send', 'query', 'receive', 'queue_size', 'status', 'clear_queue'])
         self.action_combo.currentTextChanged.connect(self.on_action_changed)
         
         action_layout.addWidget(QLabel("操作:"))
@@ -344,6 +347,7 @@ class ConfigClientGUI(QMainWindow):
                     self.connection_status.setText("已连接")
                     self.connection_status.setStyleSheet("color: green")
                     self.connect_btn.setText("断开连接")
+                    self._negotiate_framing()
                 except socket.timeout:
                     self.response_text.setText("连接超时")
                 except ConnectionRefusedError:
@@ -379,7 +383,7 @@ class ConfigClientGUI(QMainWindow):
 
     def on_action_changed(self, action):
         """处理操作类型改变"""
-        self.send_params.setVisible(action == 'send')
+        self.send_params.setVisible(action in ('send', 'query'))
         self.receive_params.setVisible(action == 'receive')
         
     def parse_com5_frame(self, frame_hex):
@@ -389,8 +393,7 @@ class ConfigClientGUI(QMainWindow):
             frame = bytes.fromhex(frame_hex)
             
             # CRC校验
-            crc = self.calculate_crc(frame[:-2])
-            if crc != frame[-2:]:
+            if not verify_frame(frame):
                 return f"CRC校验失败: {frame_hex}"
             
             # 解析响应
@@ -420,8 +423,7 @@ class ConfigClientGUI(QMainWindow):
             frame = bytes.fromhex(frame_hex)
             
             # CRC校验
-            crc = self.calculate_crc(frame[:-2])
-            if crc != frame[-2:]:
+            if not verify_frame(frame):
                 return f"CRC校验失败: {frame_hex}"
             
             # 基本信息解析
@@ -441,18 +443,6 @@ class ConfigClientGUI(QMainWindow):
         except Exception as e:
             return f"解析错误: {str(e)}"
             
-    def calculate_crc(self, data):
-        """CRC计算函数"""
-        crc = 0xFFFF
-        for byte in data:
-            crc ^= byte
-            for _ in range(8):
-                if crc & 0x0001:
-                    crc = (crc >> 1) ^ 0xA001
-                else:
-                    crc = crc >> 1
-        return crc.to_bytes(2, byteorder='little')
-
     def _build_request(self, action, selected_port):
         """构造请求数据"""
         request = {
@@ -463,17 +453,36 @@ class ConfigClientGUI(QMainWindow):
         # 根据不同action添加特定参数
         if action == 'receive':
             request["num"] = int(self.num_input.value())
-        elif action == 'send':
+        elif action in ('send', 'query'):
             request["data"] = [input.value() for input in self.data_inputs]
         
         return request
 
+    def _negotiate_framing(self):
+        """连接后协商使用NDJSON分帧，旧服务器不支持时保持花括号分帧"""
+        self.framer = create_framer(FRAMING_LEGACY)
+        response = self._send_and_receive({"action": "hello", "framing": FRAMING_NDJSON})
+        if response and response.get("status") == "success":
+            new_framer = create_framer(FRAMING_NDJSON)
+            new_framer.feed(self.framer.detach())
+            self.framer = new_framer
+
+    def _read_message(self):
+        """按当前分帧方式读取一条完整的响应"""
+        while True:
+            message = self.framer.next_message()
+            if message is not None:
+                return message
+            data = self.client_socket.recv(4096)
+            if not data:
+                raise ConnectionResetError("服务器关闭了连接")
+            self.framer.feed(data)
+
     def _send_and_receive(self, request):
         """发送请求并接收响应"""
         try:
-            self.client_socket.send(json.dumps(request).encode('utf-8'))
-            response = self.client_socket.recv(4096)
-            return json.loads(response.decode('utf-8'))
+            self.client_socket.sendall(self.framer.encode(request))
+            return self._read_message()
         except socket.timeout:
             self.response_text.setText("错误: 连接超时")
             self.disconnect_from_server()
@@ -503,6 +512,15 @@ class ConfigClientGUI(QMainWindow):
                 "parsed_data": parsed_frames
             }
             self.response_text.setText(json.dumps(result, indent=2, ensure_ascii=False))
+        elif action == 'query' and response_data.get("frame"):
+            # 解析同步查询的应答帧
+            parser = self.parsers.get(port_name, self.parsers['default'])
+            result = {
+                "status": "success",
+                "port": port_name,
+                "parsed_data": parser(response_data["frame"])
+            }
+            self.response_text.setText(json.dumps(result, indent=2, ensure_ascii=False))
         else:
             # 其他action直接显示响应
             self.response_text.setText(json.dumps(response_data, indent=2, ensure_ascii=False))
@@ -1,8 +1,11 @@
 import logging
-from serial_serve import serial_manager
+from serial_serve import serial_manager, ModbusRequest, check_read
+from poll_scheduler import PollScheduler, PollTask
+from log_sampling import SAMPLED
 import os
 import yaml
 import sys
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 # 修改logger获取方式
 logger = logging.getLogger('dataprocess')
@@ -31,16 +34,21 @@ config = load_config()
 
 retry_times = config['modbus']['retries']
 
-def return_data_num(port_name):
-    """返回指定串口的数据帧个数"""
+def return_data_num(port_name, since_seq=None):
+    """返回指定串口的数据帧个数，指定since_seq时只统计该序号之后的帧"""
     handler = serial_manager.serial_ports.get(port_name)
     if not handler:
         logger.error(f"未找到串口 {port_name} 的处理器")
         return 0
-    return handler.receive_queue.length()
+    if since_seq is None:
+        return handler.frame_log.length()
+    return handler.frame_log.available(since_seq)
 
-def send_data(port_name, slave_adress, function_code, start_address, quantity):
-    """向指定串口发送数据"""
+def send_data(port_name, slave_adress, function_code, start_address, quantity, priority=None):
+    """向指定串口发送数据
+    Raises:
+        queue.Full: 发送队列已满
+    """
     port_logger = logging.getLogger(f"SerialPort_{port_name}")
     
     handler = serial_manager.serial_ports.get(port_name)
@@ -48,17 +56,114 @@ def send_data(port_name, slave_adress, function_code, start_address, quantity):
         port_logger.error(f"未找到串口 {port_name} 的处理器")
         return False
         
-    handler.send_queue.put((slave_adress, function_code, start_address, quantity))
-    port_logger.info(f"向串口 {port_name} 发送数据: {slave_adress}, {function_code}, {start_address}, {quantity}")
+    handler.submit(ModbusRequest.read(slave_adress, function_code, start_address, quantity, priority))
+    port_logger.info("向串口 %s 发送数据: %s, %s, %s, %s", port_name, slave_adress, function_code, start_address, quantity, extra=SAMPLED)
     return True
 
+def submit_query(port_name, slave_adress, function_code, start_address, quantity, priority=None):
+    """向指定串口提交读请求，返回等待应答的future
+    Raises:
+        KeyError: 未找到串口处理器
+        ValueError: 功能码不是读功能码、数量或地址超出范围
+        queue.Full: 发送队列已满
+    """
+    check_read(function_code, start_address, quantity)
+    handler = serial_manager.serial_ports.get(port_name)
+    if not handler:
+        raise KeyError(f"未找到串口 {port_name} 的处理器")
+    return handler.submit(ModbusRequest.read(slave_adress, function_code, start_address, quantity, priority))
+
+def query_data(port_name, slave_adress, function_code, start_address, quantity, timeout=None):
+    """向指定串口发送请求并等待应答
+    Returns:
+        bytes: 应答帧；广播请求返回None
+    Raises:
+        KeyError: 未找到串口处理器
+        ValueError: 功能码不是读功能码、数量或地址超出范围
+        TimeoutError: 从机无应答或等待超时
+    """
+    if timeout is None:
+        timeout = config['modbus'].get('query_timeout', 10.0)
+    future = submit_query(port_name, slave_adress, function_code, start_address, quantity)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if future.done():
+            raise  # 从机无应答，重试后仍超时
+        future.cancel()
+        raise TimeoutError(f"等待串口 {port_name} 应答超时")
+
+def submit_write(port_name, slave_adress, function_code, start_address, values, priority=None):
+    """向指定串口提交写请求，返回等待应答的future
+    - 0x05/0x06 的values为单个值，0x0F/0x10 的values为值列表
+    Raises:
+        KeyError: 未找到串口处理器
+        ValueError: 功能码或数值不合法
+        queue.Full: 发送队列已满
+    """
+    handler = serial_manager.serial_ports.get(port_name)
+    if not handler:
+        raise KeyError(f"未找到串口 {port_name} 的处理器")
+    return handler.submit(ModbusRequest.write(slave_adress, function_code, start_address, values, priority))
+
+def write_data(port_name, slave_adress, function_code, start_address, values, timeout=None):
+    """向指定串口发送写请求并等待应答
+    Returns:
+        bytes: 应答帧；广播请求返回None
+    Raises:
+        KeyError: 未找到串口处理器
+        ValueError: 功能码或数值不合法
+        TimeoutError: 从机无应答或等待超时
+    """
+    if timeout is None:
+        timeout = config['modbus'].get('query_timeout', 10.0)
+    future = submit_write(port_name, slave_adress, function_code, start_address, values)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if future.done():
+            raise  # 从机无应答，重试后仍超时
+        future.cancel()
+        raise TimeoutError(f"等待串口 {port_name} 应答超时")
+
+def read_cached(port_name, slave_adress, function_code, start_address, quantity, max_age):
+    """从寄存器缓存读取不早于max_age秒的数值
+    Returns:
+        tuple: (数值列表, 接收时间戳)；缓存缺失或过期时返回None
+    Raises:
+        KeyError: 未找到串口处理器
+        ValueError: 功能码不是读功能码、数量或地址超出范围
+    """
+    check_read(function_code, start_address, quantity)
+    handler = serial_manager.serial_ports.get(port_name)
+    if not handler:
+        raise KeyError(f"未找到串口 {port_name} 的处理器")
+    return handler.register_cache.get(slave_adress, function_code, start_address, quantity, max_age)
+
+def start_polling(port_name, polls):
+    """按轮询表启动指定串口的轮询调度
+    Args:
+        polls: 配置文件中的轮询项列表
+    Raises:
+        KeyError: 未找到串口处理器或轮询项缺少字段
+        ValueError: 轮询项参数不合法
+    """
+    handler = serial_manager.serial_ports.get(port_name)
+    if not handler:
+        raise KeyError(f"未找到串口 {port_name} 的处理器")
+    if handler.poll_scheduler:
+        handler.poll_scheduler.stop()
+    handler.poll_scheduler = PollScheduler(handler, [PollTask.from_config(item) for item in polls])
+    handler.poll_scheduler.start()
+    return handler.poll_scheduler
+
 def clear_receive_queue(port_name):
     """清空指定串口的接收队列"""
     handler = serial_manager.serial_ports.get(port_name)
     if not handler:
         logger.error(f"未找到串口 {port_name} 的处理器")
         return False
-    handler.receive_queue.clear_queue()
+    handler.clear_queue()
     logger.info(f"串口 {port_name} 的接收队列已清空")
     return True
 
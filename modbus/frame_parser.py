@@ -0,0 +1,220 @@
+# Modbus RTU 应答帧的增量解析，由接收线程在收到数据时调用
+
+from crc import verify_frame
+
+# 帧头之后长度固定的应答：写单个线圈/寄存器、写多个线圈/寄存器的回显
+# 地址 + 功能码 + 地址(2) + 数值/数量(2) + CRC(2)
+FIXED_FRAME_LENGTHS = {
+    0x05: 8,
+    0x06: 8,
+    0x0F: 8,
+    0x10: 8,
+}
+# 带字节数的应答：地址 + 功能码 + 字节数 + 数据 + CRC(2)
+BYTE_COUNT_FUNCTIONS = (0x01, 0x02, 0x03, 0x04)
+# 异常应答：地址 + (功能码|0x80) + 异常码 + CRC(2)
+EXCEPTION_FRAME_LENGTH = 5
+
+# 可作为重新同步锚点的功能码
+KNOWN_FUNCTIONS = frozenset(FIXED_FRAME_LENGTHS) | frozenset(BYTE_COUNT_FUNCTIONS)
+
+# 解析状态
+STATE_HEADER = 0       # 等待地址和功能码
+STATE_BYTE_COUNT = 1   # 等待字节数
+STATE_BODY = 2         # 等待完整帧
+
+def frame_length(data, offset=0):
+    """
+    根据帧头计算完整帧长度
+    Returns:
+        int: 帧长度；None表示需要更多字节；0表示帧头不合法
+    """
+    if offset + 2 > len(data):
+        return None
+    function_code = data[offset + 1]
+    if function_code & 0x80:
+        if function_code & 0x7F not in KNOWN_FUNCTIONS:
+            return 0
+        return EXCEPTION_FRAME_LENGTH
+    if function_code in FIXED_FRAME_LENGTHS:
+        return FIXED_FRAME_LENGTHS[function_code]
+    if function_code not in BYTE_COUNT_FUNCTIONS:
+        return 0
+    if offset + 3 > len(data):
+        return None
+    byte_count = data[offset + 2]
+    # 寄存器读应答的字节数必为非零偶数
+    if byte_count == 0 or (function_code in (0x03, 0x04) and byte_count % 2):
+        return 0
+    return 3 + byte_count + 2
+
+class ModbusFrameParser:
+    """
+    基于状态机的Modbus RTU应答帧解析器
+    - 直接在接收环形缓冲区上查看/丢弃数据，不做逐字节拷贝
+    - 只输出CRC校验通过的完整帧
+    - 遇到CRC错误或非法帧头时进入重新同步模式，滑动查找下一个有效帧边界
+    - 帧头声明的长度超过预期应答长度、其后已出现完整帧或总线静默超过t3.5时，不再等待该帧
+    """
+    def __init__(self, buffer, logger, known_slaves=None):
+        self.buffer = buffer  # CircularQueue
+        self.logger = logger
+        # 已知从机地址，作为重新同步的锚点；为空时只按功能码匹配
+        self.known_slaves = set(known_slaves or ())
+        self.state = STATE_HEADER
+        self.frame_length = 0
+        self.resyncing = False
+        # 当前等待应答的请求的应答帧长度，帧头声明的长度超过它时视为帧头损坏；None表示不限制
+        self.expected_length = None
+        # 进入重新同步时的累计丢弃字节数，用于判断本次重新同步是否丢弃了数据
+        self.resync_mark = 0
+        self.frame_count = 0
+        self.crc_error_count = 0
+        self.resync_count = 0
+        self.discarded_bytes = 0
+
+    def add_known_slave(self, slave_address):
+        """记录已知从机地址（发送请求时调用）"""
+        self.known_slaves.add(int(slave_address))
+
+    def reset(self):
+        """丢弃解析进度，从下一个字节重新开始"""
+        self.state = STATE_HEADER
+        self.frame_length = 0
+        self.resyncing = False
+
+    def _is_anchor(self, slave_address, function_code):
+        """判断地址和功能码是否可能是一帧的开头"""
+        if self.known_slaves and slave_address not in self.known_slaves:
+            return False
+        return function_code & 0x7F in KNOWN_FUNCTIONS
+
+    def _enter_resync(self):
+        self.state = STATE_HEADER
+        self.frame_length = 0
+        if not self.resyncing:
+            self.resyncing = True
+            self.resync_mark = self.discarded_bytes
+
+    def _start_resync(self, reason):
+        """丢弃当前字节并进入重新同步模式"""
+        if not self.resyncing:
+            self.logger.warning(f"{reason}，开始重新同步")
+        self._enter_resync()
+        self.discarded_bytes += self.buffer.discard(1)
+
+    def silence(self):
+        """
+        总线静默超过t3.5时调用（收到新数据之前）
+        - 未接收完整的帧不会再继续，改为重新同步，不再按其帧头等待
+        - 不丢弃数据：若静默只是串口驱动分段造成的，重新同步仍能从原位置找到该帧
+        """
+        if self.state != STATE_HEADER and not self.resyncing:
+            self._enter_resync()
+
+    def _find_frame(self, data, start=0):
+        """
+        从start开始查找CRC有效的完整帧
+        Returns:
+            tuple: (帧偏移, 帧长度, 第一个可能未接收完整的候选帧偏移)，未找到帧时前两项为None
+        """
+        pending = None
+        for offset in range(start, len(data) - 1):
+            if not self._is_anchor(data[offset], data[offset + 1]):
+                continue
+            length = frame_length(data, offset)
+            if length == 0:
+                continue
+            if length is None or offset + length > len(data):
+                if pending is None:
+                    pending = offset
+                continue
+            if verify_frame(data[offset:offset + length]):
+                return offset, length, pending
+        return None, None, pending
+
+    def _resync(self):
+        """
+        在缓冲区中滑动查找CRC有效的帧
+        - 找到时丢弃其之前的所有字节并返回该帧
+        - 未找到时丢弃到第一个可能未接收完整的候选帧为止，返回None等待更多数据
+        """
+        data = self.buffer.peek(self.buffer.length())
+        offset, length, pending = self._find_frame(data)
+        if offset is not None:
+            self.discarded_bytes += self.buffer.discard(offset)
+            self.buffer.discard(length)
+            return data[offset:offset + length]
+
+        # 保留最后一个字节，它可能是下一帧的地址
+        keep_from = pending if pending is not None else max(len(data) - 1, 0)
+        self.discarded_bytes += self.buffer.discard(keep_from)
+        return None
+
+    def _stalled(self):
+        """等待帧体时，缓冲区中当前帧头之后已有CRC有效的完整帧，说明帧头声明的长度不可信"""
+        data = self.buffer.peek(self.buffer.length())
+        return self._find_frame(data, 1)[0] is not None
+
+    def parse(self):
+        """解析缓冲区中所有完整帧，返回bytes列表，不完整的数据留在缓冲区"""
+        frames = []
+        while True:
+            if self.resyncing:
+                frame = self._resync()
+                if frame is None:
+                    break
+                self.resyncing = False
+                self.frame_count += 1
+                if self.discarded_bytes > self.resync_mark:
+                    self.resync_count += 1
+                    self.logger.warning(f"重新同步成功，累计丢弃 {self.discarded_bytes} 字节")
+                frames.append(frame)
+                continue
+
+            if self.state == STATE_HEADER:
+                header = self.buffer.peek(2)
+                if len(header) < 2:
+                    break
+                if not self._is_anchor(header[0], header[1]):
+                    self._start_resync(f"非法帧头 {header.hex()}")
+                    continue
+                function_code = header[1]
+                if function_code & 0x80 or function_code in FIXED_FRAME_LENGTHS:
+                    self.frame_length = frame_length(header)
+                    self.state = STATE_BODY
+                else:
+                    self.state = STATE_BYTE_COUNT
+
+            if self.state == STATE_BYTE_COUNT:
+                header = self.buffer.peek(3)
+                if len(header) < 3:
+                    break
+                self.frame_length = frame_length(header)
+                if not self.frame_length:
+                    self._start_resync(f"非法字节数 {header.hex()}")
+                    continue
+                self.state = STATE_BODY
+
+            if self.expected_length and self.frame_length > self.expected_length:
+                self._start_resync(f"帧长度 {self.frame_length} 超过应答长度 {self.expected_length}")
+                continue
+
+            if self.buffer.length() < self.frame_length:
+                if self._stalled():
+                    self._start_resync(f"帧头声明 {self.frame_length} 字节但其后已有完整帧")
+                    continue
+                break
+
+            frame = self.buffer.peek(self.frame_length)
+            if verify_frame(frame):
+                self.buffer.discard(self.frame_length)
+                self.frame_count += 1
+                frames.append(frame)
+                self.state = STATE_HEADER
+                self.frame_length = 0
+            else:
+                self.crc_error_count += 1
+                self._start_resync(f"CRC校验失败: {frame.hex()}")
+
+        return frames
@@ -0,0 +1,66 @@
+# 高频日志采样：串口收发的逐帧日志按消息模板计数，每N条或每个时间间隔只记录一条
+
+import logging
+import math
+import threading
+import time
+
+# 需要采样的日志调用传入extra=SAMPLED，未标记的记录不受影响
+SAMPLED = {'sampled': True}
+
+class HexDump:
+    """日志参数：记录真正输出时才转换为十六进制字符串，被采样丢弃的记录不做转换"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.hex()
+
+class SamplingFilter(logging.Filter):
+    """
+    logger级的采样过滤器
+    - 只处理带SAMPLED标记且低于WARNING的记录，警告和错误全部保留
+    - 同一消息模板每every条放行一条；interval大于0时同一模板每interval秒最多放行一条
+    - 放行的记录附带此前省略的条数
+    """
+    def __init__(self, every=1, interval=0.0):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self.interval = float(interval)
+        self.lock = threading.Lock()
+        self.counters = {}  # {消息模板: [计数, 省略条数, 上次放行时刻]}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+        now = time.monotonic()
+        with self.lock:
+            counter = self.counters.get(record.msg)
+            if counter is None:
+                counter = self.counters[record.msg] = [0, 0, -math.inf]
+            counter[0] += 1
+            if (counter[0] - 1) % self.every or now - counter[2] < self.interval:
+                counter[1] += 1
+                return False
+            skipped = counter[1]
+            counter[1] = 0
+            counter[2] = now
+        if skipped:
+            record.msg = f"{record.msg}（省略了 {skipped} 条同类日志）"
+        return True
+
+def install_sampling(target_logger, log_config):
+    """
+    按logging配置为logger安装采样过滤器，替换已安装的；未启用采样时只移除
+    Args:
+        log_config: 配置文件的logging部分，sampling中可按logger名单独设置sample_every/sample_interval
+    """
+    for existing in [f for f in target_logger.filters if isinstance(f, SamplingFilter)]:
+        target_logger.removeFilter(existing)
+    override = (log_config.get('sampling') or {}).get(target_logger.name) or {}
+    every = override.get('sample_every', log_config.get('sample_every', 1))
+    interval = override.get('sample_interval', log_config.get('sample_interval', 0.0))
+    if every > 1 or interval > 0:
+        target_logger.addFilter(SamplingFilter(every, interval))
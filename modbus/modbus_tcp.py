@@ -0,0 +1,168 @@
+# Modbus TCP (MBAP) 网关：将Modbus TCP请求转发到对应串口的发送队列，以二进制应答
+
+import asyncio
+import logging
+import queue
+import struct
+from serial_serve import serial_manager, ModbusRequest
+from frame_parser import KNOWN_FUNCTIONS
+
+# MBAP报文头：事务标识(2) + 协议标识(2) + 长度(2) + 单元标识(1)
+MBAP_HEADER = struct.Struct('>HHHB')
+# PDU最大长度（功能码 + 数据）
+MAX_PDU_LENGTH = 253
+# 读请求和单个写请求的数据长度固定为4字节；写多个为 起始地址(2) + 数量(2) + 字节数(1) + 数据
+FIXED_REQUEST_LENGTHS = {0x01: 4, 0x02: 4, 0x03: 4, 0x04: 4, 0x05: 4, 0x06: 4}
+
+# 网关返回的异常码
+EXCEPTION_ILLEGAL_FUNCTION = 0x01
+EXCEPTION_ILLEGAL_DATA_VALUE = 0x03
+EXCEPTION_SLAVE_DEVICE_FAILURE = 0x04
+EXCEPTION_SLAVE_BUSY = 0x06
+EXCEPTION_GATEWAY_PATH_UNAVAILABLE = 0x0A
+EXCEPTION_GATEWAY_TARGET_FAILED = 0x0B
+
+logger = logging.getLogger(__name__)
+
+def build_unit_map(serial_ports):
+    """
+    由串口配置生成单元标识到串口的映射
+    Args:
+        serial_ports: 串口配置列表，slaves字段中的从机地址映射到该串口
+    """
+    unit_map = {}
+    for port_config in serial_ports:
+        port_name = port_config.get('name')
+        for slave_adress in port_config.get('slaves') or ():
+            unit_map[int(slave_adress)] = port_name
+    return unit_map
+
+class ModbusTcpGateway:
+    """
+    Modbus TCP网关
+    - 单元标识即从机地址，按unit_map找到串口，未配置的单元使用default_port
+    - 每个连接可以有多个未完成的请求，应答按完成顺序返回，由事务标识区分
+    - 请求直接以PDU构造ModbusRequest进入串口发送队列，参与优先级、合并、去重和熔断
+    - 单元标识0按广播发送，不返回应答
+    """
+    def __init__(self, unit_map, default_port=None, max_outstanding=16, max_clients=50, timeout=10.0):
+        self.unit_map = dict(unit_map)
+        self.default_port = default_port
+        self.max_outstanding = max_outstanding
+        self.max_clients = max_clients
+        self.timeout = timeout
+        self.server = None
+        self.client_count = 0
+        self.request_count = 0
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(
+            self.handle_client, host, port,
+            reuse_address=True,
+            backlog=self.max_clients
+        )
+        logger.info(f"Modbus TCP网关已启动，监听 {host}:{port}，单元映射 {self.unit_map}，默认串口 {self.default_port}")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def wait_closed(self):
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    def _handler_for(self, unit_id):
+        port_name = self.unit_map.get(unit_id, self.default_port)
+        return serial_manager.serial_ports.get(port_name) if port_name else None
+
+    async def handle_client(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        if self.client_count >= self.max_clients:
+            logger.warning(f"Modbus TCP连接数已达上限 {self.max_clients}，拒绝连接: {address}")
+            writer.close()
+            return
+        self.client_count += 1
+        logger.info(f"Modbus TCP客户端已连接: {address}")
+        # 限制单个连接未完成的请求数，达到上限时暂停读取
+        slots = asyncio.Semaphore(self.max_outstanding)
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack(header)
+                if protocol_id != 0 or not 2 <= length <= MAX_PDU_LENGTH + 1:
+                    logger.warning(f"Modbus TCP报文头无效，关闭连接: {address} {header.hex()}")
+                    break
+                pdu = await reader.readexactly(length - 1)
+                await slots.acquire()
+                task = asyncio.create_task(self._process(writer, transaction_id, unit_id, pdu, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"处理Modbus TCP客户端 {address} 时出错: {e}")
+        finally:
+            self.client_count -= 1
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            logger.info(f"Modbus TCP客户端断开连接: {address}")
+
+    async def _process(self, writer, transaction_id, unit_id, pdu, slots):
+        """
+        转发单个请求并写回应答
+        - 转发中出现未预期的错误（包括请求的future被取消）时以异常码04应答，客户端不会等不到该事务的应答
+        - 写出后等待发送缓冲区排空再释放名额，读取过慢的客户端不会使缓冲区无限增长
+        """
+        try:
+            try:
+                response = await self._forward(unit_id, pdu)
+            except asyncio.CancelledError:
+                if writer.is_closing():
+                    raise  # 连接已关闭，任务随连接取消
+                logger.warning(f"Modbus TCP请求被取消 unit={unit_id} pdu={pdu.hex()}")
+                response = bytes([pdu[0] | 0x80, EXCEPTION_SLAVE_DEVICE_FAILURE])
+            except Exception as e:
+                logger.error(f"Modbus TCP请求处理出错 unit={unit_id} pdu={pdu.hex()}: {e}")
+                response = bytes([pdu[0] | 0x80, EXCEPTION_SLAVE_DEVICE_FAILURE])
+            if response is not None and not writer.is_closing():
+                writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit_id) + response)
+                await writer.drain()
+        except ConnectionError:
+            pass  # 客户端已断开
+        finally:
+            slots.release()
+
+    async def _forward(self, unit_id, pdu):
+        """
+        将PDU发往串口并等待应答
+        Returns:
+            bytes: 应答PDU；广播请求返回None
+        """
+        self.request_count += 1
+        function_code = pdu[0]
+        if function_code not in KNOWN_FUNCTIONS:
+            return bytes([function_code | 0x80, EXCEPTION_ILLEGAL_FUNCTION])
+        payload = pdu[1:]
+        if function_code in FIXED_REQUEST_LENGTHS:
+            valid = len(payload) == FIXED_REQUEST_LENGTHS[function_code]
+        else:
+            valid = len(payload) >= 5 and payload[4] == len(payload) - 5
+        if not valid:
+            return bytes([function_code | 0x80, EXCEPTION_ILLEGAL_DATA_VALUE])
+        handler = self._handler_for(unit_id)
+        if handler is None:
+            return bytes([function_code | 0x80, EXCEPTION_GATEWAY_PATH_UNAVAILABLE])
+
+        try:
+            future = handler.submit(ModbusRequest(unit_id, function_code, payload))
+            frame = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except queue.Full:
+            return bytes([function_code | 0x80, EXCEPTION_SLAVE_BUSY])
+        except (asyncio.TimeoutError, TimeoutError, OSError) as e:  # OSError包含从机熔断时的ConnectionError
+            handler.logger.warning(f"Modbus TCP请求失败 unit={unit_id} pdu={pdu.hex()}: {e}")
+            return bytes([function_code | 0x80, EXCEPTION_GATEWAY_TARGET_FAILED])
+        if frame is None:
+            return None  # 广播
+        return frame[1:-2]
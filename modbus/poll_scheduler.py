@@ -0,0 +1,184 @@
+# 服务端轮询调度：按config.yaml中的轮询表周期性读取从机数据
+
+import heapq
+import threading
+import time
+import logging
+import queue
+from concurrent.futures import CancelledError, wait
+from serial_serve import ModbusRequest, PRIORITY_LOW, check_read
+
+class PollTask:
+    """
+    轮询表中的一项
+    - period: 轮询周期（秒）
+    - priority: 数值越小优先级越高，多个任务同时到期时先发送高优先级的
+    """
+    def __init__(self, slave_adress, function_code, start_address, quantity, period, priority=0):
+        # 与read_cached/query相同的读请求检查，非法的轮询项在加载时拒绝
+        check_read(function_code, start_address, quantity)
+        if period <= 0:
+            raise ValueError(f"轮询周期必须大于0: {period}")
+        self.slave_adress = slave_adress
+        self.function_code = function_code
+        self.start_address = start_address
+        self.quantity = quantity
+        self.period = float(period)
+        self.priority = priority
+        self.deadline = 0.0
+        # 统计
+        self.run_count = 0
+        self.error_count = 0
+        self.missed_count = 0     # 错过的周期数
+        self.max_lateness = 0.0   # 最大发送延迟（秒）
+        self.last_frame = None
+        self.last_time = None
+        self.last_error = None
+
+    @classmethod
+    def from_config(cls, item):
+        """由配置项构造，配置项包含 slave, function_code, start_address, quantity, period, priority"""
+        return cls(
+            int(item['slave']),
+            int(item['function_code']),
+            int(item['start_address']),
+            int(item['quantity']),
+            float(item['period']),
+            int(item.get('priority', 0))
+        )
+
+    def request(self):
+        return ModbusRequest.read(self.slave_adress, self.function_code, self.start_address, self.quantity, PRIORITY_LOW)
+
+    def status(self):
+        return {
+            "slave": self.slave_adress,
+            "function_code": self.function_code,
+            "start_address": self.start_address,
+            "quantity": self.quantity,
+            "period": self.period,
+            "priority": self.priority,
+            "runs": self.run_count,
+            "errors": self.error_count,
+            "missed": self.missed_count,
+            "max_lateness": round(self.max_lateness, 4),
+            "last_frame": self.last_frame.hex() if self.last_frame else None,
+            "last_time": self.last_time,
+            "last_error": self.last_error
+        }
+
+    def __repr__(self):
+        return f"{self.slave_adress:02x} {self.function_code:02x} {self.start_address}+{self.quantity}/{self.period}s"
+
+class PollScheduler:
+    """
+    单个串口的轮询调度器
+    - 所有任务按截止时间放入小顶堆，到期的任务中优先发送优先级高的，已错过一个周期的任务最先发送
+    - 同一时刻只有一个轮询请求在发送队列中，客户端请求可以插入两次轮询之间
+    - 下次截止时间按周期累加，不随发送延迟漂移；延迟超过一个周期时跳过错过的周期并计入missed
+    - 应答帧和其他帧一样进入帧日志，客户端通过receive或subscribe获取
+    """
+    def __init__(self, handler, tasks):
+        self.handler = handler
+        self.tasks = list(tasks)
+        self.logger = logging.getLogger(f"SerialPort_{handler.port_name}")
+        self.heap = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """启动调度线程，所有任务立即到期一次"""
+        now = time.monotonic()
+        self.heap = []
+        for index, task in enumerate(self.tasks):
+            task.deadline = now
+            heapq.heappush(self.heap, (task.deadline, task.priority, index))
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._run,
+            name=f"Poll_{self.handler.port_name}"
+        )
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.info(f"轮询调度已启动，共 {len(self.tasks)} 个任务")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _next_due(self):
+        """等待到最早的截止时间，返回到期任务中优先级最高的(任务, 序号)；停止时返回None"""
+        while not self.stop_event.is_set() and self.handler.is_connected:
+            now = time.monotonic()
+            deadline = self.heap[0][0]
+            if deadline > now:
+                self.stop_event.wait(deadline - now)
+                continue
+            # 取出所有到期任务，选优先级最高（其次截止时间最早）的一个，其余放回；
+            # 已经延迟整个周期的任务排在最前，避免总线繁忙时低优先级任务一直得不到发送
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap))
+            due.sort(key=lambda entry: (now - entry[0] < self.tasks[entry[2]].period, entry[1], entry[0]))
+            for entry in due[1:]:
+                heapq.heappush(self.heap, entry)
+            return self.tasks[due[0][2]], due[0][2]
+        return None
+
+    def _run(self):
+        if not self.tasks:
+            return
+        while True:
+            item = self._next_due()
+            if item is None:
+                break
+            task, index = item
+            self._poll(task)
+            self._reschedule(task)
+            heapq.heappush(self.heap, (task.deadline, task.priority, index))
+        self.logger.info("轮询调度已停止")
+
+    def _poll(self, task):
+        """发送一次轮询并等待结果"""
+        lateness = time.monotonic() - task.deadline
+        task.max_lateness = max(task.max_lateness, lateness)
+        task.run_count += 1
+        try:
+            future = self.handler.submit(task.request())
+        except queue.Full as e:
+            task.error_count += 1
+            task.last_error = str(e)
+            return
+        # 串口断开后发送线程不再处理请求，不能无限等待
+        while not future.done():
+            if self.stop_event.is_set() or not self.handler.is_connected:
+                future.cancel()
+                return
+            wait([future], timeout=1)
+        try:
+            frame = future.result()
+            task.last_frame = frame
+            task.last_time = time.time()
+            task.last_error = None
+        except CancelledError:
+            task.error_count += 1
+            task.last_error = "请求已取消"
+        except Exception as e:
+            task.error_count += 1
+            task.last_error = str(e)
+            self.logger.warning(f"轮询失败 {task}: {e}")
+
+    def _reschedule(self, task):
+        """计算下次截止时间，延迟超过整个周期的直接跳过"""
+        task.deadline += task.period
+        now = time.monotonic()
+        if now - task.deadline >= task.period:
+            missed = int((now - task.deadline) // task.period)
+            task.missed_count += missed
+            task.deadline += missed * task.period
+            self.logger.warning(f"轮询任务 {task} 错过 {missed} 个周期，累计 {task.missed_count}")
+
+    def missed_count(self):
+        return sum(task.missed_count for task in self.tasks)
+
+    def status(self):
+        return [task.status() for task in self.tasks]
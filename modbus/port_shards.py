@@ -0,0 +1,523 @@
+# 多进程串口分片：串口在工作进程中收发和解析，解析出的帧经共享内存环形缓冲区回到TCP前端进程
+
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import CancelledError
+from functools import partial
+from multiprocessing import shared_memory
+from serial_serve import config, create_handler, FrameLog, ModbusRequest
+from register_cache import RegisterCache
+
+# 环形缓冲区头部：写位置、读位置、数据区容量（位置单调递增，对容量取模得到偏移）
+RING_HEADER = struct.Struct('<QQQ')
+# 帧记录头部：串口序号、帧长度、接收时间戳；记录按8字节对齐
+RECORD_HEADER = struct.Struct('<HHd')
+RECORD_ALIGN = 8
+# 数据区末尾放不下一条记录时写入的回绕标记，读取方跳回数据区开头
+WRAP_MARKER = 0xFFFF
+# 工作进程上报计数的间隔（秒）
+STATS_INTERVAL = 1.0
+# 等待工作进程打开串口的时间（秒）
+OPEN_TIMEOUT = 10.0
+
+logger = logging.getLogger(__name__)
+
+def _align(size):
+    return (size + RECORD_ALIGN - 1) // RECORD_ALIGN * RECORD_ALIGN
+
+class FrameRing:
+    """
+    共享内存中的单生产者单消费者帧环形缓冲区
+    - 工作进程写入（多个串口的写入由调用方加锁串行化），前端进程的读取线程读出
+    - 帧以原始字节写入共享内存，不经过pickle
+    - 缓冲区满时put返回False，由调用方丢弃该帧
+    """
+    def __init__(self, shm):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = RING_HEADER.unpack_from(self.buf, 0)[2]
+
+    @classmethod
+    def create(cls, size):
+        capacity = max(size // RECORD_ALIGN * RECORD_ALIGN, RECORD_ALIGN * 64)
+        shm = shared_memory.SharedMemory(create=True, size=RING_HEADER.size + capacity)
+        RING_HEADER.pack_into(shm.buf, 0, 0, 0, capacity)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        # 工作进程与前端进程共用同一个resource_tracker，共享内存由创建方释放
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def put(self, port_index, timestamp, frame):
+        """写入一帧，缓冲区剩余空间不足时返回False"""
+        head, tail, _ = RING_HEADER.unpack_from(self.buf, 0)
+        size = _align(RECORD_HEADER.size + len(frame))
+        offset = head % self.capacity
+        skip = self.capacity - offset if self.capacity - offset < size else 0
+        if head + skip + size - tail > self.capacity:
+            return False
+        if skip:
+            struct.pack_into('<H', self.buf, RING_HEADER.size + offset, WRAP_MARKER)
+            offset = 0
+        start = RING_HEADER.size + offset
+        RECORD_HEADER.pack_into(self.buf, start, port_index, len(frame), timestamp)
+        self.buf[start + RECORD_HEADER.size:start + RECORD_HEADER.size + len(frame)] = frame
+        # 数据写完后再更新写位置，读取方看到新位置时记录已完整
+        struct.pack_into('<Q', self.buf, 0, head + skip + size)
+        return True
+
+    def get(self):
+        """
+        读出一帧
+        Returns:
+            tuple: (串口序号, 时间戳, 帧)；缓冲区为空时返回None
+        """
+        head, tail, _ = RING_HEADER.unpack_from(self.buf, 0)
+        if tail == head:
+            return None
+        offset = tail % self.capacity
+        if struct.unpack_from('<H', self.buf, RING_HEADER.size + offset)[0] == WRAP_MARKER:
+            tail += self.capacity - offset
+            offset = 0
+        start = RING_HEADER.size + offset
+        port_index, length, timestamp = RECORD_HEADER.unpack_from(self.buf, start)
+        frame = bytes(self.buf[start + RECORD_HEADER.size:start + RECORD_HEADER.size + length])
+        struct.pack_into('<Q', self.buf, 8, tail + _align(RECORD_HEADER.size + length))
+        return port_index, timestamp, frame
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+# ---------------- 工作进程 ----------------
+
+def _setup_worker_logging(log_queue):
+    """工作进程的日志全部经队列交给前端进程写入"""
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    for name in [''] + list(logging.root.manager.loggerDict):
+        target = logging.getLogger(name)
+        if isinstance(target, logging.Logger):
+            target.handlers = []
+            target.disabled = False  # fork时继承了前端dictConfig禁用的logger
+    logging.root.handlers = [queue_handler]
+    logging.root.setLevel(logging.DEBUG)
+    return queue_handler
+
+def _worker_main(ring_name, conn, doorbell, log_queue):
+    """工作进程入口"""
+    queue_handler = _setup_worker_logging(log_queue)
+    ShardWorker(FrameRing.attach(ring_name), conn, doorbell, queue_handler).run()
+
+class ShardWorker:
+    """
+    工作进程中的串口分片
+    - 按前端的open命令打开串口，串口处理器与单进程模式相同（可以是asyncio引擎）
+    - 请求和应答经管道传递，解析出的帧写入共享内存环形缓冲区
+    """
+    def __init__(self, ring, conn, doorbell, queue_handler):
+        self.ring = ring
+        self.conn = conn
+        self.doorbell = doorbell
+        self.queue_handler = queue_handler
+        self.handlers = {}   # {串口序号: SerialHandler}
+        self.requests = {}   # {请求编号: ModbusRequest}
+        self.send_lock = threading.Lock()
+        self.ring_lock = threading.Lock()
+        self.dropped_count = 0
+        self.running = True
+
+    def _send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def run(self):
+        stats_thread = threading.Thread(target=self._report_stats, name="ShardStats")
+        stats_thread.daemon = True
+        stats_thread.start()
+        try:
+            while self.running:
+                message = self.conn.recv()
+                getattr(self, f"_on_{message[0]}")(*message[1:])
+        except (EOFError, OSError):
+            pass  # 前端进程已退出
+        finally:
+            self.running = False
+            for handler in self.handlers.values():
+                handler.disconnect()
+            self.ring.close()
+
+    def _on_open(self, port_index, port_name, baudrate, timeout, slaves):
+        logging.getLogger(f"SerialPort_{port_name}").handlers = [self.queue_handler]
+        handler = create_handler(port_name, baudrate, timeout, slaves)
+        if handler is not None:
+            handler.add_frame_listener(partial(self._on_frame, port_index))
+            self.handlers[port_index] = handler
+        self._send(('opened', port_index, handler is not None))
+
+    def _on_frame(self, port_index, port_name, seq, timestamp, frame):
+        with self.ring_lock:
+            stored = self.ring.put(port_index, timestamp, frame)
+        if stored:
+            self.doorbell.release()
+        else:
+            self.dropped_count += 1
+
+    def _on_submit(self, request_id, port_index, slave_adress, function_code, payload, priority):
+        request = ModbusRequest(slave_adress, function_code, payload, priority)
+        self.requests[request_id] = request
+        request.future.add_done_callback(partial(self._reply, request_id))
+        try:
+            self.handlers[port_index].submit(request)
+        except queue.Full:
+            pass  # submit已将异常设置到该请求的future
+
+    def _on_cancel(self, request_id):
+        request = self.requests.get(request_id)
+        if request is not None:
+            request.future.cancel()
+
+    def _on_clear(self, port_index):
+        self.handlers[port_index].clear_queue()
+
+    def _on_disconnect(self, port_index):
+        handler = self.handlers.pop(port_index, None)
+        if handler is not None:
+            handler.disconnect()
+
+    def _on_stop(self):
+        self.running = False
+
+    def _reply(self, request_id, future):
+        self.requests.pop(request_id, None)
+        try:
+            if future.cancelled():
+                self._send(('cancelled', request_id))
+            elif future.exception() is not None:
+                self._send(('error', request_id, future.exception()))
+            else:
+                self._send(('result', request_id, future.result()))
+        except (EOFError, OSError):
+            pass
+
+    def _report_stats(self):
+        reported_drops = 0
+        while self.running:
+            time.sleep(STATS_INTERVAL)
+            if self.dropped_count != reported_drops:
+                logger.warning(f"帧环形缓冲区已满，累计丢弃 {self.dropped_count} 帧")
+                reported_drops = self.dropped_count
+            stats = {
+                port_index: dict(handler.stats(),
+                                 connected=handler.is_connected,
+                                 estimated_wait=handler.estimated_wait(),
+                                 ring_dropped=self.dropped_count)
+                for port_index, handler in list(self.handlers.items())
+            }
+            try:
+                self._send(('stats', stats))
+            except (EOFError, OSError):
+                break
+
+# ---------------- 前端进程 ----------------
+
+class _LogDispatcher(logging.Handler):
+    """把工作进程的日志记录交给本进程同名的logger"""
+    def handle(self, record):
+        target = logging.getLogger(record.name)
+        if target.isEnabledFor(record.levelno):
+            target.handle(record)
+        return True
+
+class PortProxy:
+    """
+    前端进程中代替SerialHandler的串口代理
+    - submit将请求经管道发往工作进程，返回的future在收到应答时完成
+    - 帧日志、帧监听、寄存器缓存和轮询调度都在前端进程中，客户端接口与单进程模式一致
+    - 发送队列、熔断器和解析计数在工作进程中，由定时上报的stats提供
+    """
+    def __init__(self, shard, port_index, port_name):
+        self.shard = shard
+        self.port_index = port_index
+        self.port_name = port_name
+        self.is_connected = False
+        self.frame_log = FrameLog()
+        self.register_cache = RegisterCache()
+        self.poll_scheduler = None
+        self.listener_lock = threading.Lock()
+        self.frame_listeners = ()
+        self.remote_stats = {}
+        self.opened = threading.Event()
+        self.logger = logging.getLogger(f"SerialPort_{port_name}")
+
+    def submit(self, request):
+        """
+        将请求发往工作进程，返回等待应答的future
+        - 发送队列已满时future以queue.Full失败
+        """
+        # 写请求使对应地址的缓存失效
+        self.register_cache.invalidate_write(request)
+        return self.shard.submit(self, request)
+
+    def stats(self):
+        stats = dict(self.remote_stats)
+        stats.pop('connected', None)
+        stats.pop('estimated_wait', None)
+        return stats
+
+    def estimated_wait(self):
+        return self.remote_stats.get('estimated_wait', 0.0)
+
+    def add_frame_listener(self, callback):
+        with self.listener_lock:
+            self.frame_listeners = self.frame_listeners + (callback,)
+
+    def remove_frame_listener(self, callback):
+        with self.listener_lock:
+            self.frame_listeners = tuple(listener for listener in self.frame_listeners if listener is not callback)
+
+    def _append_frame(self, timestamp, frame):
+        """记录工作进程解析出的帧并通知监听者"""
+        seq = self.frame_log.append(frame, timestamp)
+        for listener in self.frame_listeners:
+            try:
+                listener(self.port_name, seq, timestamp, frame)
+            except Exception as e:
+                self.logger.error(f"帧监听回调出错: {e}")
+
+    def clear_queue(self):
+        """清空帧日志和工作进程中的接收缓冲区"""
+        self.frame_log.clear()
+        self.shard.send(('clear', self.port_index))
+
+    def disconnect(self):
+        try:
+            if self.poll_scheduler:
+                self.poll_scheduler.stop()
+            if self.is_connected:
+                self.is_connected = False
+                self.shard.send(('disconnect', self.port_index))
+            self.logger.info(f"成功断开串口{self.port_name}")
+            return True
+        except Exception as e:
+            self.logger.error(f"断开串口{self.port_name}失败: {e}")
+            return False
+
+class PortShard:
+    """前端进程中的一个工作进程：管道、共享内存环形缓冲区及其读取线程"""
+    def __init__(self, index, context, log_queue):
+        self.index = index
+        self.ring = FrameRing.create(config['serial'].get('shard_ring_size', 1024 * 1024))
+        self.conn, worker_conn = context.Pipe()
+        self.doorbell = context.Semaphore(0)
+        self.process = context.Process(
+            target=_worker_main,
+            args=(self.ring.name, worker_conn, self.doorbell, log_queue),
+            name=f"SerialShard_{index}"
+        )
+        self.process.daemon = True
+        self.send_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = {}  # {请求编号: (PortProxy, ModbusRequest)}
+        self.next_request_id = 0
+        self.proxies = {}  # {串口序号: PortProxy}
+        # 串口序号不复用：打开超时被放弃的序号，其迟到的打开结果不会落到之后打开的串口上
+        self.next_port_index = 0
+        self.threads = []
+        self.running = True
+
+    def start(self):
+        self.process.start()
+        for target, name in ((self._receive_messages, "Messages"), (self._receive_frames, "Frames")):
+            thread = threading.Thread(target=target, name=f"Shard{self.index}_{name}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"串口工作进程 {self.index} 已启动，pid={self.process.pid}，环形缓冲区 {self.ring.capacity} 字节")
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def open_port(self, port_name, baudrate, timeout, slaves):
+        """在工作进程中打开串口，成功时返回代理，失败返回None"""
+        port_index = self.next_port_index
+        self.next_port_index += 1
+        proxy = PortProxy(self, port_index, port_name)
+        self.proxies[port_index] = proxy
+        self.send(('open', port_index, port_name, baudrate, timeout, slaves))
+        if not proxy.opened.wait(OPEN_TIMEOUT) or not proxy.is_connected:
+            del self.proxies[port_index]
+            return None
+        return proxy
+
+    def submit(self, proxy, request):
+        with self.pending_lock:
+            self.next_request_id += 1
+            request_id = self.next_request_id
+            self.pending[request_id] = (proxy, request)
+        request.future.add_done_callback(partial(self._cancel_remote, request_id))
+        try:
+            self.send(('submit', request_id, proxy.port_index, request.slave_adress,
+                       request.function_code, request.payload, request.priority))
+        except (EOFError, OSError) as e:
+            self._finish(request_id, exception=OSError(f"串口工作进程不可用: {e}"))
+        return request.future
+
+    def _cancel_remote(self, request_id, future):
+        """等待方取消请求（如客户端超时）时通知工作进程，尚未发送的请求不再占用总线"""
+        if future.cancelled() and self.running:
+            try:
+                self.send(('cancel', request_id))
+            except (EOFError, OSError):
+                pass
+
+    def _finish(self, request_id, frame=None, exception=None):
+        with self.pending_lock:
+            entry = self.pending.pop(request_id, None)
+        if entry is None:
+            return
+        proxy, request = entry
+        if not request.future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            request.future.set_exception(exception)
+        else:
+            proxy.register_cache.update(request, frame)
+            request.future.set_result(frame)
+
+    def _receive_messages(self):
+        """处理工作进程发来的应答、串口打开结果和计数"""
+        try:
+            while True:
+                message = self.conn.recv()
+                try:
+                    self._handle_message(message)
+                except Exception as e:
+                    # 单条消息出错不能结束接收线程，否则该分片上等待应答的请求都不会完成
+                    logger.error(f"处理串口工作进程 {self.index} 的消息出错: {message!r}: {e}")
+        except (EOFError, OSError):
+            pass
+        if self.running:
+            logger.error(f"串口工作进程 {self.index} 已退出，exitcode={self.process.exitcode}")
+        self.running = False
+        for proxy in self.proxies.values():
+            proxy.is_connected = False
+            proxy.opened.set()
+        with self.pending_lock:
+            request_ids = list(self.pending)
+        for request_id in request_ids:
+            self._finish(request_id, exception=ConnectionError(f"串口工作进程 {self.index} 已退出"))
+
+    def _handle_message(self, message):
+        kind = message[0]
+        if kind == 'result':
+            self._finish(message[1], frame=message[2])
+        elif kind == 'error':
+            self._finish(message[1], exception=message[2])
+        elif kind == 'cancelled':
+            self._finish(message[1], exception=CancelledError())
+        elif kind == 'stats':
+            for port_index, stats in message[1].items():
+                proxy = self.proxies.get(port_index)
+                if proxy is not None:
+                    proxy.remote_stats = stats
+        elif kind == 'opened':
+            proxy = self.proxies.get(message[1])
+            if proxy is None:
+                # open_port已等待超时并放弃该串口，工作进程中打开成功的串口随即关闭
+                logger.warning(f"串口工作进程 {self.index} 在超时后才返回打开结果，端口序号 {message[1]}")
+                if message[2]:
+                    self.send(('disconnect', message[1]))
+                return
+            proxy.is_connected = message[2]
+            proxy.opened.set()
+        else:
+            logger.warning(f"串口工作进程 {self.index} 发来未知消息: {message!r}")
+
+    def _receive_frames(self):
+        """从环形缓冲区读出帧，每帧对应doorbell的一次release"""
+        while self.running:
+            if not self.doorbell.acquire(timeout=1.0):
+                continue
+            item = self.ring.get()
+            if item is None:
+                continue
+            port_index, timestamp, frame = item
+            proxy = self.proxies.get(port_index)
+            if proxy is not None:
+                proxy._append_frame(timestamp, frame)
+
+    def stop(self):
+        self.running = False
+        try:
+            self.send(('stop',))
+        except (EOFError, OSError):
+            pass
+        self.process.join(timeout=2.0)
+        # 唤醒帧读取线程，等它退出后才能释放共享内存
+        self.doorbell.release()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+
+_shards = []
+_shards_lock = threading.Lock()
+_log_listener = None
+
+def _get_shard(port_number):
+    """按串口启动顺序轮流分配工作进程，工作进程在首次使用时启动"""
+    global _log_listener
+    with _shards_lock:
+        workers = config['serial'].get('workers', 0)
+        if not _shards:
+            # 所有工作进程使用spawn启动，Windows和Linux行为一致，也避免fork带走前端进程的线程
+            context = multiprocessing.get_context('spawn')
+            log_queue = context.Queue()
+            _log_listener = logging.handlers.QueueListener(log_queue, _LogDispatcher())
+            _log_listener.start()
+            for index in range(workers):
+                _shards.append(PortShard(index, context, log_queue))
+        shard = _shards[port_number % workers]
+        if shard.process.pid is None:
+            shard.start()
+        return shard
+
+_port_count = 0
+
+def open_remote_port(com, baudrate, timeout=1, slaves=None):
+    """
+    在工作进程中打开串口
+    Returns:
+        PortProxy: 串口代理；打开失败时返回None
+    """
+    global _port_count
+    shard = _get_shard(_port_count)
+    _port_count += 1
+    proxy = shard.open_port(com, baudrate, timeout, list(slaves) if slaves else None)
+    if proxy is None:
+        logger.error(f"工作进程 {shard.index} 打开串口 {com} 失败")
+    return proxy
+
+def stop_shards():
+    """停止所有工作进程并释放共享内存"""
+    global _log_listener
+    with _shards_lock:
+        for shard in _shards:
+            if shard.process.pid is not None:
+                shard.stop()
+            shard.ring.close(unlink=True)
+        _shards.clear()
+        if _log_listener is not None:
+            _log_listener.stop()
+            _log_listener = None
@@ -0,0 +1,110 @@
+# 寄存器最新值缓存：每次读请求成功应答后更新，供read_cached直接返回
+
+import threading
+import time
+
+# 可缓存的读功能码：线圈、离散输入按位，保持/输入寄存器按16位
+BIT_FUNCTIONS = (0x01, 0x02)
+REGISTER_FUNCTIONS = (0x03, 0x04)
+# 写功能码影响的读功能码：写线圈对应读线圈，写寄存器对应读保持寄存器
+WRITE_TARGETS = {
+    0x05: 0x01,
+    0x0F: 0x01,
+    0x06: 0x03,
+    0x10: 0x03,
+}
+
+def decode_values(function_code, frame, quantity):
+    """
+    从读应答帧中解出数值列表
+    Returns:
+        list: 线圈/离散输入为0/1，寄存器为16位无符号整数；帧长度不足时返回None
+    """
+    data = frame[3:-2]
+    if function_code in REGISTER_FUNCTIONS:
+        if len(data) < quantity * 2:
+            return None
+        return [int.from_bytes(data[i * 2:i * 2 + 2], 'big') for i in range(quantity)]
+    if function_code in BIT_FUNCTIONS:
+        if len(data) * 8 < quantity:
+            return None
+        return [(data[i // 8] >> (i % 8)) & 1 for i in range(quantity)]
+    return None
+
+class RegisterCache:
+    """
+    单个串口的寄存器缓存
+    - 键为(从机地址, 功能码, 寄存器地址)，值为(数值, 接收时间戳)
+    - 由发送线程在请求得到正常应答时写入，TCP请求读取
+    """
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def update(self, request, frame, timestamp=None):
+        """用读请求及其应答帧更新缓存，异常应答和非读请求忽略"""
+        function_code = request.function_code
+        if function_code not in BIT_FUNCTIONS and function_code not in REGISTER_FUNCTIONS:
+            return
+        if frame is None or frame[1] & 0x80:
+            return
+        start_address = int.from_bytes(request.payload[0:2], 'big')
+        quantity = int.from_bytes(request.payload[2:4], 'big')
+        values = decode_values(function_code, frame, quantity)
+        if values is None:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        slave_adress = request.slave_adress
+        with self.lock:
+            for offset, value in enumerate(values):
+                self.values[(slave_adress, function_code, start_address + offset)] = (value, timestamp)
+
+    def get(self, slave_adress, function_code, start_address, quantity, max_age):
+        """
+        读取连续quantity个地址的缓存值
+        Returns:
+            tuple: (数值列表, 最早的接收时间戳)；任一地址未缓存或早于max_age秒时返回None
+        """
+        oldest = time.time() - max_age
+        values = []
+        timestamp = None
+        with self.lock:
+            for address in range(start_address, start_address + quantity):
+                entry = self.values.get((slave_adress, function_code, address))
+                if entry is None or entry[1] < oldest:
+                    self.miss_count += 1
+                    return None
+                values.append(entry[0])
+                if timestamp is None or entry[1] < timestamp:
+                    timestamp = entry[1]
+            self.hit_count += 1
+        return values, timestamp
+
+    def invalidate_write(self, request):
+        """写请求使被写地址的缓存失效，非写请求忽略"""
+        read_function = WRITE_TARGETS.get(request.function_code)
+        if read_function is None:
+            return
+        start_address = int.from_bytes(request.payload[0:2], 'big')
+        quantity = 1 if request.function_code in (0x05, 0x06) else int.from_bytes(request.payload[2:4], 'big')
+        slave_adress = request.slave_adress
+        with self.lock:
+            if slave_adress == 0:
+                # 广播写对所有从机生效
+                keys = [key for key in self.values
+                        if key[1] == read_function and start_address <= key[2] < start_address + quantity]
+            else:
+                keys = [(slave_adress, read_function, address) for address in range(start_address, start_address + quantity)]
+            for key in keys:
+                self.values.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def size(self):
+        with self.lock:
+            return len(self.values)
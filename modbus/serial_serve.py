@@ -8,7 +8,15 @@ import queue
 import logging
 import os
 from collections import deque
+from itertools import islice
+from functools import partial
+from concurrent.futures import Future
 import sys
+from crc import calculate_crc
+from frame_parser import ModbusFrameParser, FIXED_FRAME_LENGTHS
+from register_cache import RegisterCache
+from circuit_breaker import CircuitBreaker, STATE_HALF_OPEN
+from log_sampling import HexDump, SAMPLED, install_sampling
 
 def load_config():
     # 首先尝试读取外部配置文件
@@ -35,183 +43,554 @@ max_length = config['tcp_server']['buffer_size']
 # 配置日志
 logger = logging.getLogger(__name__)
 
-def get_complete_frames(receive_queue, port_logger, number_of_frames):
-    """获取完整的Modbus帧
+def get_complete_frames(frame_log, port_logger, number_of_frames, since_seq):
+    """获取完整的Modbus帧（不会从日志中移除）
     Args:
-        receive_queue: 接收队列
+        frame_log: 帧日志
         port_logger: 串口日志记录器
         number_of_frames: 需要读取的帧数
+        since_seq: 从该序号开始读取
     Returns:
-        list: 完整帧的列表，每个元素为十六进制字符串
+        tuple: (十六进制字符串帧列表, 首帧序号, 下次读取的序号)
     """
-    frames = []
-    temp_bytes = []
-    frame_size = 0
-    collecting = False
-    retry = 0
-
-    if receive_queue.length() < 3:
-        port_logger.warning(f"数据不足，当前队列长度: {receive_queue.length()} 字节")
-        return None
+    entries, first_seq, next_seq = frame_log.read(since_seq, number_of_frames)
+    if first_seq > since_seq:
+        port_logger.warning(f"序号 {since_seq} 至 {first_seq - 1} 的帧已被覆盖")
+    return [frame.hex() for _, _, frame in entries], first_seq, next_seq
 
-    while len(frames) < number_of_frames:
-        try:
-            if not collecting:
-                # 读取前3个字节
-                if receive_queue.length() < 3:
-                    break
-                    
-                for _ in range(3):
-                    byte_data = receive_queue.dequeue()
-                    temp_bytes.append(byte_data)
-                    
-                # 计算完整帧大小
-                data_length = temp_bytes[2]
-                frame_size = 2 + 1 + data_length + 2
-                collecting = True
-                
-            # 继续收集剩余字节
-            remaining_bytes = frame_size - len(temp_bytes)
-            if receive_queue.length() < remaining_bytes:
-                break
-            
-            for _ in range(remaining_bytes):
-                byte_data = receive_queue.dequeue()
-                temp_bytes.append(byte_data)
-            
-            # 组合完整帧
-            if len(temp_bytes) == frame_size:
-                frame_data = bytes(temp_bytes)
-                frames.append(frame_data.hex())
-                temp_bytes = []
-                frame_size = 0
-                collecting = False
-                
-        except Exception as e:
-            port_logger.error(f"获取完整帧时出错: {e}")
-            retry += 1
-            if retry >= config['modbus']['retries']:
-                port_logger.error("重试次数过多，停止读取")
-                break
-            temp_bytes = []
-            frame_size = 0
-            collecting = False
+class FrameLog:
+    """
+    已解析帧的有界日志
+    - 每帧带递增序号和接收时间戳，超出容量时覆盖最早的帧
+    - 读取不移除帧，各消费者用自己的序号游标读取，互不影响
+    """
+    def __init__(self, max_frames=config['serial'].get('frame_log_size', 1000)):
+        self.entries = deque(maxlen=max_frames)  # (seq, timestamp, frame)
+        self.next_seq = 0
+        self.lock = threading.Lock()
+
+    def append(self, frame, timestamp):
+        """追加一帧，返回其序号"""
+        with self.lock:
+            seq = self.next_seq
+            self.entries.append((seq, timestamp, frame))
+            self.next_seq += 1
+            return seq
+
+    def first_seq(self):
+        """日志中最早一帧的序号，日志为空时等于next_seq"""
+        with self.lock:
+            return self.entries[0][0] if self.entries else self.next_seq
 
-    return frames
+    def read(self, since_seq, count):
+        """
+        读取序号不小于since_seq的最多count帧
+        Returns:
+            tuple: (条目列表, 首条目序号, 下次读取的序号)
+        """
+        with self.lock:
+            first_seq = self.entries[0][0] if self.entries else self.next_seq
+            start_seq = min(max(since_seq, first_seq), self.next_seq)
+            index = start_seq - first_seq
+            entries = list(islice(self.entries, index, index + max(count, 0)))
+            return entries, start_seq, start_seq + len(entries)
+
+    def available(self, since_seq):
+        """序号不小于since_seq的帧数"""
+        with self.lock:
+            first_seq = self.entries[0][0] if self.entries else self.next_seq
+            return self.next_seq - min(max(since_seq, first_seq), self.next_seq)
+
+    def length(self):
+        """日志中保留的帧数"""
+        with self.lock:
+            return len(self.entries)
+
+    def clear(self):
+        """清空日志，序号继续递增"""
+        with self.lock:
+            self.entries.clear()
 
 class CircularQueue:
-    """循环队列实现，用于存储串口接收到的数据"""
+    """环形字节缓冲区，用于存储串口接收到的数据
+
+    预分配固定大小的bytearray，通过读指针和数据长度回绕读写。
+    write/peek/read/discard均为批量操作，每次调用只获取一次锁。
+    """
     def __init__(self, max_size=max_length):
-        self.queue = deque(maxlen=max_size)
         self.max_size = max_size
+        self.buffer = bytearray(max_size)
+        self.view = memoryview(self.buffer)
+        self.head = 0  # 读指针
+        self.size = 0  # 当前数据字节数
         self.lock = threading.Lock()
-        self.is_full = False
         self.has_overflowed = False
         self.overflow_count = 0
         self.paused = False  # 添加暂停标志
         self.logger = logging.getLogger(__name__)
-        
-    def enqueue(self, data):
-        """数据入队"""
+
+    def write(self, data):
+        """批量写入数据
+
+        空间不足时写满剩余空间并暂停接收，返回实际写入的字节数
+        """
         with self.lock:
-            # 如果队列已满或已暂停，拒绝写入数据
+            # 已暂停时拒绝写入数据
             if self.paused:
-                return False
-                
-            if len(self.queue) >= self.max_size:
+                return 0
+
+            count = min(len(data), self.max_size - self.size)
+            if count:
+                tail = (self.head + self.size) % self.max_size
+                first = min(count, self.max_size - tail)
+                # 使用with及时释放视图，调用方随后可以调整bytearray大小
+                with memoryview(data) as source:
+                    self.view[tail:tail + first] = source[:first]
+                    if count > first:
+                        self.view[:count - first] = source[first:count]
+                self.size += count
+
+            if count < len(data):
                 self.has_overflowed = True
                 self.overflow_count += 1
                 self.paused = True  # 暂停接收
-                
+
                 # 记录日志
                 self.logger.warning(
                     f"接收队列第 {self.overflow_count} 次溢出，队列已满，暂停接收新数据"
                 )
-                
-                # 返回False表示未写入数据
-                return False
-                
-            # 正常情况，添加数据
-            self.queue.append(data)
-            return True
-            
-    def process_full_queue(self, port_logger):
-        """处理满队列中的所有完整帧"""
-        if not self.paused:
-            return
-            
-        try:
-            # 循环处理队列中的所有完整帧
-            frames_processed = 0
-            max_frames = 50  # 最多处理50个帧，避免处理太久
-            
-            while frames_processed < max_frames:
-                frames = get_complete_frames(self, port_logger, 1)  # 每次处理一个完整帧
-                if not frames:
-                    break  # 没有更多完整帧了
-                    
-                for frame in frames:
-                    # 记录已处理的帧
-                    port_logger.warning(f"队列满，自动处理帧: {frame}")
-                    frames_processed += 1
-            
-            # 记录处理结果
-            if frames_processed > 0:
-                port_logger.warning(f"队列满处理完成: 已处理 {frames_processed} 个完整帧")
-            else:
-                port_logger.warning("队列满但未找到完整帧")
-                
-            # 重置暂停状态
-            with self.lock:
-                self.paused = False
-                port_logger.info("已恢复接收新数据")
-                
-        except Exception as e:
-            port_logger.error(f"处理满队列时出错: {e}")
-            # 确保恢复接收状态
-            with self.lock:
-                self.paused = False
-                
+
+            return count
+
+    def _copy_out(self, count):
+        """复制从读指针开始的count字节，调用方需持有锁"""
+        count = min(count, self.size)
+        first = min(count, self.max_size - self.head)
+        if count > first:
+            return bytes(self.view[self.head:self.head + first]) + bytes(self.view[:count - first])
+        return bytes(self.view[self.head:self.head + count])
+
+    def _advance(self, count):
+        """移动读指针，调用方需持有锁"""
+        count = min(count, self.size)
+        self.head = (self.head + count) % self.max_size
+        self.size -= count
+        if self.size == 0:
+            self.head = 0
+        return count
+
+    def peek(self, count):
+        """查看最早的count字节但不取出，数据不足时返回全部数据"""
+        with self.lock:
+            return self._copy_out(count)
+
+    def read(self, count):
+        """取出最早的count字节，数据不足时返回全部数据"""
+        with self.lock:
+            data = self._copy_out(count)
+            self._advance(len(data))
+            return data
+
+    def discard(self, count):
+        """丢弃最早的count字节，返回实际丢弃的字节数"""
+        with self.lock:
+            return self._advance(count)
+
+    def resume(self):
+        """恢复接收新数据"""
+        with self.lock:
+            self.paused = False
+
     def is_paused(self):
         """检查队列是否暂停接收"""
         return self.paused
-        
-    def dequeue(self):
-        """取出最早的数据"""
-        with self.lock:
-            if len(self.queue) == 0:
-                return None
-            return self.queue.popleft()
 
     def length(self):
         """获取队列长度"""
         with self.lock:
-            return len(self.queue)
+            return self.size
         
     def clear_queue(self):
         """清空队列"""
         with self.lock:
-            self.queue.clear()
+            self.head = 0
+            self.size = 0
             self.paused = False  # 清空队列后恢复接收
 
-# ====== Modbus CRC计算函数 ======
+# 单次读请求的最大数量：线圈/离散输入2000位，保持/输入寄存器125个
+READ_LIMITS = {
+    0x01: 2000,
+    0x02: 2000,
+    0x03: 125,
+    0x04: 125,
+}
+
+def check_read(function_code, start_address, quantity):
+    """
+    检查读请求的功能码、起始地址和数量
+    Raises:
+        ValueError: 功能码不是读功能码(0x01-0x04)、数量超出范围或地址范围超出0-65535
+    """
+    if function_code not in READ_LIMITS:
+        raise ValueError(f"功能码 {function_code} 不是读功能码(1-4)")
+    if not 0 < quantity <= READ_LIMITS[function_code]:
+        raise ValueError(f"功能码 {function_code:02x} 的读取数量必须为1到{READ_LIMITS[function_code]}: {quantity}")
+    if not 0 <= start_address <= 0x10000 - quantity:
+        raise ValueError(f"读取地址范围超出0-65535: {start_address}+{quantity}")
+
+# 单次写多个的最大数量
+WRITE_LIMITS = {
+    0x0F: 1968,
+    0x10: 123,
+}
+# 单个写功能码对应的写多个功能码
+MULTIPLE_WRITE_FUNCTIONS = {
+    0x05: 0x0F,
+    0x06: 0x10,
+}
+
+def pack_bits(values):
+    """线圈值按Modbus规则打包，第一个值在首字节最低位"""
+    data = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value:
+            data[i // 8] |= 1 << (i % 8)
+    return bytes(data)
+
+# 发送优先级，数值越小越先发送
+PRIORITY_HIGH = 0     # 写请求和操作员命令
+PRIORITY_NORMAL = 1   # 客户端读请求
+PRIORITY_LOW = 2      # 后台轮询
+PRIORITIES = {
+    'high': PRIORITY_HIGH,
+    'normal': PRIORITY_NORMAL,
+    'low': PRIORITY_LOW,
+}
 
-def calculate_crc(data):
+class ModbusRequest:
+    """一次Modbus事务：请求内容以及等待应答结果的future"""
+    def __init__(self, slave_adress, function_code, payload, priority=None):
+        self.slave_adress = int(slave_adress)
+        self.function_code = int(function_code)
+        self.payload = bytes(payload)  # 功能码之后、CRC之前的数据
+        # 未指定时读请求为普通优先级，其他请求（写）为高优先级
+        if priority is None:
+            priority = PRIORITY_NORMAL if self.function_code in READ_LIMITS else PRIORITY_HIGH
+        self.priority = priority
+        self.future = Future()
+        self.attempts = 0
+
+    @classmethod
+    def read(cls, slave_adress, function_code, start_address, quantity, priority=None):
+        """构造读请求：起始地址 + 数量"""
+        payload = int(start_address).to_bytes(2, 'big') + int(quantity).to_bytes(2, 'big')
+        return cls(slave_adress, function_code, payload, priority)
+
+    @classmethod
+    def write(cls, slave_adress, function_code, start_address, values, priority=None):
+        """
+        构造写请求
+        - 0x05/0x06: values为单个值
+        - 0x0F/0x10: values为值列表
+        Raises:
+            ValueError: 功能码不是写功能码或数值不合法
+        """
+        start = int(start_address).to_bytes(2, 'big')
+        if function_code == 0x05:
+            payload = start + (b'\xff\x00' if values else b'\x00\x00')
+        elif function_code == 0x06:
+            payload = start + _register_bytes(values)
+        elif function_code in WRITE_LIMITS:
+            if not isinstance(values, (list, tuple)) or not 0 < len(values) <= WRITE_LIMITS[function_code]:
+                raise ValueError(f"功能码 {function_code:02x} 的数值必须为1到{WRITE_LIMITS[function_code]}个元素的列表")
+            if function_code == 0x0F:
+                data = pack_bits(values)
+            else:
+                data = b''.join(_register_bytes(value) for value in values)
+            payload = start + len(values).to_bytes(2, 'big') + bytes([len(data)]) + data
+        else:
+            raise ValueError(f"不支持的写功能码: {function_code}")
+        return cls(slave_adress, function_code, payload, priority)
+
+    def write_value(self):
+        """单个写请求(0x05/0x06)返回(地址, 值)，其他请求返回None"""
+        if self.function_code not in MULTIPLE_WRITE_FUNCTIONS or len(self.payload) != 4:
+            return None
+        address = int.from_bytes(self.payload[0:2], 'big')
+        if self.function_code == 0x05:
+            return address, int(self.payload[2:4] == b'\xff\x00')
+        return address, int.from_bytes(self.payload[2:4], 'big')
+
+    def frame(self):
+        """完整的RTU请求帧"""
+        frame = bytes([self.slave_adress, self.function_code]) + self.payload
+        return frame + calculate_crc(frame)
+
+    def matches(self, frame):
+        """
+        判断应答帧是否属于本请求
+        - 从机地址和功能码一致（含异常应答）
+        - 读请求的正常应答还要求字节数与请求数量一致，之前超时请求的迟到应答不会被误认
+        """
+        if frame[0] != self.slave_adress or frame[1] & 0x7F != self.function_code:
+            return False
+        if frame[1] & 0x80:
+            return True
+        byte_count = self.reply_byte_count()
+        return byte_count is None or frame[2] == byte_count
+
+    def flight_key(self):
+        """相同读请求的去重键，非读请求和广播请求返回None"""
+        if self.slave_adress == 0 or self.read_range() is None:
+            return None
+        return self.slave_adress, self.function_code, self.payload
+
+    def read_range(self):
+        """读请求返回(起始地址, 数量)，其他请求返回None"""
+        if self.function_code not in READ_LIMITS or len(self.payload) != 4:
+            return None
+        return int.from_bytes(self.payload[0:2], 'big'), int.from_bytes(self.payload[2:4], 'big')
+
+    def reply_byte_count(self):
+        """读请求正常应答中的字节数，其他请求返回None"""
+        read_range = self.read_range()
+        if read_range is None:
+            return None
+        if self.function_code in (0x03, 0x04):
+            return read_range[1] * 2
+        return (read_range[1] + 7) // 8
+
+    def reply_length(self):
+        """正常应答帧的长度，无法预知时返回None"""
+        byte_count = self.reply_byte_count()
+        if byte_count is not None:
+            return 3 + byte_count + 2
+        return FIXED_FRAME_LENGTHS.get(self.function_code)
+
+    def __repr__(self):
+        return f"{self.slave_adress:02x} {self.function_code:02x} {self.payload.hex()}"
+
+def _register_bytes(value):
+    value = int(value)
+    if not 0 <= value <= 0xFFFF:
+        raise ValueError(f"寄存器值超出范围 0-65535: {value}")
+    return value.to_bytes(2, 'big')
+
+class CoalescedRead(ModbusRequest):
     """
-    crc初始为0xFFFF，遍历data的每个字节，与crc异或运算作为新的crc
-    - 如果crc的最低位为1，则将crc右移1位，并异或0xA001
-    - 否则，将crc右移1位
-    - 最后返回低字节在前，高字节在后的CRC
+    合并后的读请求
+    - 同一从机、同一功能码、地址相邻/重叠（或间隔不超过gap）的读请求合并为一次总线事务
+    - 应答按各原请求的地址范围拆分成独立的应答帧
     """
-    crc = 0xffff
-    for byte in data:
-        crc ^= byte
-        for _ in range(8):
-            if crc & 0x0001:
-                crc = (crc >> 1) ^ 0xA001
+    def __init__(self, first):
+        start_address, quantity = first.read_range()
+        super().__init__(first.slave_adress, first.function_code, first.payload, first.priority)
+        self.start_address = start_address
+        self.end_address = start_address + quantity
+        self.parts = [first]
+
+    def try_add(self, request, gap):
+        """请求可以并入时扩展地址范围并返回True"""
+        if request.slave_adress != self.slave_adress or request.function_code != self.function_code:
+            return False
+        read_range = request.read_range()
+        if read_range is None:
+            return False
+        start_address, end_address = read_range[0], read_range[0] + read_range[1]
+        if start_address > self.end_address + gap or end_address + gap < self.start_address:
+            return False
+        new_start = min(start_address, self.start_address)
+        new_end = max(end_address, self.end_address)
+        if new_end - new_start > READ_LIMITS[self.function_code]:
+            return False
+        self.start_address, self.end_address = new_start, new_end
+        self.payload = new_start.to_bytes(2, 'big') + (new_end - new_start).to_bytes(2, 'big')
+        self.priority = min(self.priority, request.priority)
+        self.parts.append(request)
+        return True
+
+    def split(self, frame):
+        """
+        将合并请求的应答帧拆分为各原请求的应答帧，异常应答原样分给每个请求
+        Raises:
+            ValueError: 应答的字节数与合并后的请求不符
+        """
+        if frame[1] & 0x80:
+            return [frame] * len(self.parts)
+        if frame[2] != self.reply_byte_count() or len(frame) != self.reply_length():
+            raise ValueError(f"应答字节数与合并请求不符: {frame.hex()}")
+        data = frame[3:-2]
+        frames = []
+        for part in self.parts:
+            start_address, quantity = part.read_range()
+            offset = start_address - self.start_address
+            if self.function_code in (0x03, 0x04):
+                chunk = data[offset * 2:(offset + quantity) * 2]
             else:
-                crc = crc >> 1
-    return crc.to_bytes(2, byteorder='little')
+                chunk = bytearray((quantity + 7) // 8)
+                for i in range(quantity):
+                    bit = offset + i
+                    if (data[bit // 8] >> (bit % 8)) & 1:
+                        chunk[i // 8] |= 1 << (i % 8)
+            body = bytes([self.slave_adress, self.function_code, len(chunk)]) + bytes(chunk)
+            frames.append(body + calculate_crc(body))
+        return frames
+
+    def __repr__(self):
+        return f"{super().__repr__()} (合并 {len(self.parts)} 个请求)"
+
+class CoalescedWrite(ModbusRequest):
+    """
+    合并后的写请求
+    - 同一从机、地址连续的单个写线圈(0x05)/寄存器(0x06)合并为一次写多个(0x0F/0x10)
+    - 应答按原请求拆分：单个写的正常应答就是请求帧的回显
+    """
+    def __init__(self, first):
+        self.single_function = first.function_code
+        self.start_address, value = first.write_value()
+        self.values = [value]
+        super().__init__(first.slave_adress, MULTIPLE_WRITE_FUNCTIONS[first.function_code], b'', first.priority)
+        self.parts = [first]
+        self._build_payload()
+
+    def _build_payload(self):
+        self.payload = ModbusRequest.write(self.slave_adress, self.function_code, self.start_address, self.values).payload
+
+    def try_add(self, request):
+        """请求紧接在当前地址范围之后时并入并返回True"""
+        if request.slave_adress != self.slave_adress or request.function_code != self.single_function:
+            return False
+        address, value = request.write_value()
+        if address != self.start_address + len(self.values) or len(self.values) >= WRITE_LIMITS[self.function_code]:
+            return False
+        self.values.append(value)
+        self.priority = min(self.priority, request.priority)
+        self.parts.append(request)
+        self._build_payload()
+        return True
+
+    def split(self, frame):
+        """拆分为各原请求的应答帧，异常应答改为各自功能码的异常应答"""
+        if frame[1] & 0x80:
+            body = bytes([self.slave_adress, self.single_function | 0x80, frame[2]])
+            return [body + calculate_crc(body)] * len(self.parts)
+        return [part.frame() for part in self.parts]
+
+    def __repr__(self):
+        return f"{super().__repr__()} (合并 {len(self.parts)} 个写请求)"
+
+class SendQueue:
+    """
+    有界优先级发送队列
+    - 每个优先级一个FIFO，总是先取高优先级的请求
+    - 队列满时高优先级请求挤掉最后入队的低优先级请求，否则拒绝入队
+    - 发送线程取出一个请求后还可以按条件取出后续可合并的请求
+    """
+    def __init__(self, max_size=None):
+        self.levels = [deque() for _ in PRIORITIES]
+        self.max_size = max_size
+        self.size = 0
+        self.not_empty = threading.Condition()
+        # 入队后的通知回调（异步引擎用来唤醒事件循环中的发送协程）
+        self.on_put = None
+
+    def put(self, request):
+        """请求入队
+        Raises:
+            queue.Full: 队列已满且没有更低优先级的请求可以挤掉
+        """
+        evicted = None
+        with self.not_empty:
+            if self.max_size and self.size >= self.max_size:
+                evicted = self._evict_below(request.priority)
+                if evicted is None:
+                    raise queue.Full(f"发送队列已满 ({self.size}/{self.max_size})")
+            self.levels[request.priority].append(request)
+            self.size += 1
+            self.not_empty.notify()
+        # 在锁外完成被挤出的请求，其回调可能再次提交请求
+        if evicted is not None and evicted.future.set_running_or_notify_cancel():
+            evicted.future.set_exception(queue.Full(f"发送队列已满，请求被更高优先级的请求挤出: {evicted}"))
+        if self.on_put is not None:
+            self.on_put()
+
+    def _evict_below(self, priority):
+        """移除优先级低于priority的最后入队的请求"""
+        for level in reversed(self.levels[priority + 1:]):
+            if level:
+                self.size -= 1
+                return level.pop()
+        return None
+
+    def get(self, timeout=None):
+        """取出优先级最高的最早请求
+        Raises:
+            queue.Empty: timeout秒内没有请求
+        """
+        with self.not_empty:
+            if not self.not_empty.wait_for(lambda: self.size, timeout):
+                raise queue.Empty
+            for level in self.levels:
+                if level:
+                    self.size -= 1
+                    return level.popleft()
+
+    def promote(self, request, priority):
+        """将仍在排队的请求提升到更高优先级"""
+        with self.not_empty:
+            if priority >= request.priority:
+                return
+            try:
+                self.levels[request.priority].remove(request)
+            except ValueError:
+                return  # 已被取出
+            request.priority = priority
+            self.levels[priority].append(request)
+
+    def pop_where(self, select):
+        """
+        按优先级和入队顺序对队列中的请求调用select
+        - 返回True取出，False保留，None停止扫描（其后的请求都保留，包括更低优先级的）
+        Returns:
+            list: 取出的请求
+        """
+        taken = []
+        with self.not_empty:
+            for index, items in enumerate(self.levels):
+                kept = deque()
+                stopped = False
+                while items:
+                    item = items.popleft()
+                    decision = select(item)
+                    if decision is None:
+                        items.appendleft(item)
+                        stopped = True
+                        break
+                    if decision:
+                        taken.append(item)
+                    else:
+                        kept.append(item)
+                kept.extend(items)
+                self.levels[index] = kept
+                if stopped:
+                    break
+            self.size -= len(taken)
+        return taken
+
+    def qsize(self):
+        with self.not_empty:
+            return self.size
+
+def silent_intervals(baudrate):
+    """
+    根据波特率计算Modbus RTU的t1.5和t3.5静默间隔（秒）
+    - 每个字符按11位计算（起始位+8数据位+校验/停止位）
+    - 波特率高于19200时使用规范推荐的固定值750us和1750us
+    """
+    if baudrate > 19200:
+        return 0.00075, 0.00175
+    char_time = 11.0 / baudrate
+    return 1.5 * char_time, 3.5 * char_time
 
 class SerialManager:
     """串口管理类，用于管理多个串口连接"""
@@ -220,22 +599,61 @@ class SerialManager:
         
 class SerialHandler:
     """单个串口处理类"""
-    def __init__(self, port_name, baudrate, timeout=1):
+    def __init__(self, port_name, baudrate, timeout=1, slaves=None):
         self.port_name = port_name
         self.baudrate = baudrate
         self.timeout = timeout
         self.serial_port = None
         self.is_connected = False
+        # 由波特率推算的帧间静默时间
+        self.char_time = 11.0 / baudrate
+        self.t15, self.t35 = silent_intervals(baudrate)
+        # 最近一次收到数据的时刻，以及最近一帧发送完毕的预计时刻
+        self.last_rx_time = 0.0
+        self.tx_end_time = 0.0
+        # event: 阻塞读取，数据到达立即唤醒；poll: 轮询in_waiting
+        self.receive_mode = config['serial'].get('receive_mode', 'event')
         self.receive_queue = CircularQueue()
-        self.send_queue = queue.Queue()
+        self.frame_log = FrameLog()
+        self.send_queue = SendQueue(config['serial'].get('send_queue_size', 100))
+        # 最近事务耗时的滑动平均（秒），用于估算排队等待时间
+        self.transaction_time = 0.0
+        # 当前等待应答的请求，由接收线程匹配应答后唤醒发送线程
+        self.pending_lock = threading.Lock()
+        self.pending_request = None
+        self.response_frame = None
+        self.response_event = threading.Event()
+        # 排队中或正在发送的读请求 {flight_key: request}，相同的读请求共用一次事务
+        # 不支持写多个(0x0F/0x10)的从机，写请求不再合并
+        self.single_write_slaves = set()
+        self.flight_lock = threading.Lock()
+        self.in_flight = {}
+        self.dedup_count = 0
+        # 连续无应答的从机熔断，避免占用总线
+        self.breaker = CircuitBreaker(
+            config['modbus'].get('breaker_threshold', 3),
+            config['modbus'].get('breaker_backoff', 1.0),
+            config['modbus'].get('breaker_max_backoff', 60.0)
+        )
+        # 读请求成功应答后更新的寄存器缓存
+        self.register_cache = RegisterCache()
+        # 帧监听回调 callback(port_name, seq, timestamp, frame)，由接收线程在解析出帧时调用
+        self.listener_lock = threading.Lock()
+        self.frame_listeners = ()
         self.receive_thread = None
         self.send_thread = None
+        # 服务端轮询调度器，配置了轮询表时由start_polling创建
+        self.poll_scheduler = None
         # 添加临时缓冲区用于存储被拒绝的数据
         self.temp_buffer = bytearray()
         # 使用独立的logger
         self.logger = logging.getLogger(f"SerialPort_{self.port_name}")
         # 确保该logger不会传播到父logger
         self.logger.propagate = False
+        # 逐帧的收发日志按logging配置采样
+        install_sampling(self.logger, config.get('logging') or {})
+        # 接收时增量解析帧
+        self.parser = ModbusFrameParser(self.receive_queue, self.logger, slaves)
         
     def connect(self):
         """连接串口"""
@@ -287,7 +705,7 @@ class SerialHandler:
                 if self.receive_queue.is_paused():
                     # 队列已满，处理队列中的完整帧
                     self.logger.info("接收队列已满，开始处理队列中的数据")
-                    self.receive_queue.process_full_queue(self.logger)
+                    self._process_full_queue()
                     
                     # 尝试写入临时缓冲区中的数据
                     if self.temp_buffer and not self.receive_queue.is_paused():
@@ -300,78 +718,433 @@ class SerialHandler:
                     self._process_temp_buffer()
                 
                 # 正常接收数据
-                if self.serial_port.in_waiting > 0:
-                    data = self.serial_port.read(self.serial_port.in_waiting)
-                    if data:
-                        # 直接尝试将数据添加到临时缓冲区，然后处理
-                        self.temp_buffer.extend(data)
-                        self.logger.info(f"接收到的数据: {data.hex()}, 共 {len(data)} 字节")
-                        
-                        # 处理临时缓冲区数据
-                        self._process_temp_buffer()
-                else:
-                    time.sleep(config['serial']['receive_time'])
+                data = self._read_serial()
+                if data:
+                    self._handle_received(data)
             except Exception as e:
+                if not self.is_connected:
+                    break  # 断开连接时阻塞中的读取会抛出异常
                 self.logger.error(f"接收数据线程错误: {e}")
                 time.sleep(config['serial']['receive_error_time'])
+
+    def _handle_received(self, data):
+        """处理从串口读到的数据"""
+        now = time.monotonic()
+        # 距上次收到数据已超过t3.5，之前未接收完整的帧不会再继续
+        if now - self.last_rx_time > self.t35:
+            self.parser.silence()
+        self.last_rx_time = now
+        # 直接尝试将数据添加到临时缓冲区，然后处理
+        self.temp_buffer.extend(data)
+        self.logger.info("接收到的数据: %s, 共 %d 字节", HexDump(data), len(data), extra=SAMPLED)
+
+        # 处理临时缓冲区数据
+        self._process_temp_buffer()
+
+    def _read_serial(self):
+        """从串口读取数据，无数据时返回空bytes"""
+        if self.receive_mode == 'event':
+            # 阻塞至首字节到达（最多timeout秒），Linux下pyserial内部对串口fd做select，
+            # Windows下为重叠I/O等待，数据到达即唤醒；随后一次读出驱动缓冲区中的剩余数据
+            data = self.serial_port.read(1)
+            if data:
+                waiting = self.serial_port.in_waiting
+                if waiting:
+                    data += self.serial_port.read(waiting)
+            return data
+
+        if self.serial_port.in_waiting > 0:
+            return self.serial_port.read(self.serial_port.in_waiting)
+        time.sleep(config['serial']['receive_time'])
+        return b''
     
     def _process_temp_buffer(self):
         """处理临时缓冲区中的数据"""
         if not self.temp_buffer:
             return
             
-        successful_writes = 0
-        remaining_bytes = bytearray()
-        
-        # 尝试将临时缓冲区中的数据写入队列
-        for byte_data in self.temp_buffer:
-            if self.receive_queue.is_paused():
-                # 队列再次满了，保留剩余数据
-                remaining_bytes.append(byte_data)
-            elif self.receive_queue.enqueue(byte_data):
-                successful_writes += 1
-            else:
-                # 队列刚刚满了，保留剩余数据
-                remaining_bytes.append(byte_data)
-        
-        # 更新临时缓冲区为未写入的数据
-        self.temp_buffer = remaining_bytes
+        # 批量写入队列，未写入的数据保留在临时缓冲区
+        successful_writes = self.receive_queue.write(self.temp_buffer)
+        del self.temp_buffer[:successful_writes]
         
         # 记录处理结果
         if successful_writes > 0:
-            self.logger.info(f"从临时缓冲区写入 {successful_writes} 字节数据")
+            self.logger.info("从临时缓冲区写入 %d 字节数据", successful_writes, extra=SAMPLED)
+            self._parse_frames()
         if self.temp_buffer:
             self.logger.warning(f"临时缓冲区仍有 {len(self.temp_buffer)} 字节等待处理")
 
+    def _parse_frames(self):
+        """解析接收缓冲区中的完整帧并放入帧队列"""
+        for frame in self.parser.parse():
+            self.logger.info("解析到完整帧: %s", HexDump(frame), extra=SAMPLED)
+            # 合并读请求的应答按原请求拆分后再记录，客户端看到的仍是各自请求的应答
+            for logged_frame in self._on_frame(frame):
+                timestamp = time.time()
+                seq = self.frame_log.append(logged_frame, timestamp)
+                self._notify_listeners(seq, timestamp, logged_frame)
+
+    def add_frame_listener(self, callback):
+        """注册帧监听回调，回调在接收线程中执行，应尽快返回"""
+        with self.listener_lock:
+            self.frame_listeners = self.frame_listeners + (callback,)
+
+    def remove_frame_listener(self, callback):
+        """移除帧监听回调"""
+        with self.listener_lock:
+            self.frame_listeners = tuple(listener for listener in self.frame_listeners if listener is not callback)
+
+    def _notify_listeners(self, seq, timestamp, frame):
+        """将新解析出的帧通知所有监听者"""
+        for listener in self.frame_listeners:
+            try:
+                listener(self.port_name, seq, timestamp, frame)
+            except Exception as e:
+                self.logger.error(f"帧监听回调出错: {e}")
+
+    def _process_full_queue(self):
+        """接收缓冲区已满时解析其中的完整帧，仍无法腾出空间则丢弃全部数据"""
+        try:
+            self._parse_frames()
+            if self.receive_queue.length() >= self.receive_queue.max_size:
+                self.logger.warning("接收缓冲区已满但未找到完整帧，丢弃缓冲区数据")
+                self.receive_queue.clear_queue()
+                self.parser.reset()
+        except Exception as e:
+            self.logger.error(f"处理满队列时出错: {e}")
+        finally:
+            # 确保恢复接收状态
+            self.receive_queue.resume()
+            self.logger.info("已恢复接收新数据")
+
+    def clear_queue(self):
+        """清空接收缓冲区和帧日志"""
+        self.receive_queue.clear_queue()
+        self.parser.reset()
+        self.frame_log.clear()
+
+    def submit(self, request):
+        """
+        将请求放入发送队列，返回等待应答的future
+        - 已有相同的读请求在排队或发送时不再入队，等待该请求的结果
+        - 从机熔断中时请求直接以ConnectionError失败，不进入发送队列
+        Raises:
+            queue.Full: 发送队列已满
+        """
+        if request.slave_adress and self.breaker.is_open(request.slave_adress):
+            request.future.set_exception(self._breaker_error(request))
+            return request.future
+        key = request.flight_key() if config['modbus'].get('single_flight', True) else None
+        if key is not None:
+            with self.flight_lock:
+                leader = self.in_flight.get(key)
+                if leader is None or leader.future.done():
+                    self.in_flight[key] = request
+                    leader = None
+                else:
+                    self.dedup_count += 1
+            if leader is not None:
+                # 高优先级的等待者把排队中的相同请求一起提前
+                self.send_queue.promote(leader, request.priority)
+                leader.future.add_done_callback(partial(self._follow, request))
+                return request.future
+            request.future.add_done_callback(partial(self._land, key, request))
+        try:
+            self.send_queue.put(request)
+        except queue.Full as e:
+            # 已附加到该请求上的相同读请求一并失败
+            request.future.set_exception(e)
+            raise
+        return request.future
+
+    def stats(self):
+        """发送和解析相关的计数，status接口使用"""
+        return {
+            "crc_errors": self.parser.crc_error_count,
+            "resync_count": self.parser.resync_count,
+            "deduplicated": self.dedup_count,
+            "send_queue": self.send_queue.qsize(),
+            "breakers": self.breaker.status()
+        }
+
+    def estimated_wait(self):
+        """按队列长度和平均事务耗时估算新请求需要等待的时间（秒）"""
+        return self.send_queue.qsize() * max(self.transaction_time, self.t35)
+
+    def _land(self, key, request, future):
+        """请求完成后从去重表中移除"""
+        with self.flight_lock:
+            if self.in_flight.get(key) is request:
+                del self.in_flight[key]
+
+    def _follow(self, request, future):
+        """相同读请求完成时把结果转给等待者；被取消时重新提交"""
+        if future.cancelled():
+            if not request.future.done():
+                try:
+                    self.submit(request)
+                except queue.Full:
+                    pass  # submit已将异常设置到该请求的future
+            return
+        if not request.future.set_running_or_notify_cancel():
+            return
+        exception = future.exception()
+        if exception is not None:
+            request.future.set_exception(exception)
+        else:
+            request.future.set_result(future.result())
+
+    def _on_frame(self, frame):
+        """收到完整帧时匹配当前等待应答的请求，返回需要记录到帧日志的帧"""
+        with self.pending_lock:
+            request = self.pending_request
+            if request is None or not request.matches(frame):
+                return (frame,)
+            self.pending_request = None
+            self.parser.expected_length = None
+            self.response_frame = frame
+            self.response_event.set()
+        if isinstance(request, (CoalescedRead, CoalescedWrite)) and not frame[1] & 0x80:
+            try:
+                return request.split(frame)
+            except ValueError as e:
+                self.logger.error(str(e))  # 发送线程拆分同一应答时会使各原请求失败
+        return (frame,)
+
     def _send_task(self):
         """发送数据线程"""
         self.logger.info(f"串口{self.port_name}发送线程已启动")
         while self.is_connected:
             try:
-                data = self.send_queue.get(timeout=1)
-                slave_adress, function_code, start_address, quantity = data
-                self.send_data(slave_adress, function_code, start_address, quantity)
-                time.sleep(config['serial']['send_time'])
+                request = self._coalesce(self.send_queue.get(timeout=1))
+                if request is None:
+                    continue
+                started = time.monotonic()
+                resend = ()
+                try:
+                    self._transact(request)
+                finally:
+                    # 事务出错时也要让合并的原请求全部完成
+                    if isinstance(request, (CoalescedRead, CoalescedWrite)):
+                        resend = self._complete_parts(request)
+                self.transaction_time += (time.monotonic() - started - self.transaction_time) * 0.2
+                for part in resend:
+                    self._exchange(part)
             except queue.Empty:
                 pass
             except Exception as e:
                 self.logger.error(f"发送数据线程错误: {e}")
                 time.sleep(config['serial']['send_error_time'])
 
-    def send_data(self, slave_adress, function_code, start_address, quantity):
+    def _coalesce(self, request):
+        """
+        从发送队列中取出可与request合并的请求
+        - 读请求：合并地址相邻/重叠的读，遇到发往同一从机的非读请求时停止，读请求不越过之前提交的写请求
+        - 单个写请求：合并紧随其后、地址连续的同类单个写，遇到发往同一从机的其他请求时停止
+        Returns:
+            合并后的请求；没有可合并的请求时返回原请求；合并的请求全部已取消时返回None
+        """
+        if request.slave_adress == 0:
+            return request
+        if request.read_range() is not None:
+            if not config['modbus'].get('coalesce', True):
+                return request
+            gap = config['modbus'].get('coalesce_gap', 0)
+            merged = CoalescedRead(request)
+
+            def select(item):
+                if item.slave_adress == merged.slave_adress and item.read_range() is None:
+                    return None
+                return merged.try_add(item, gap)
+        elif request.write_value() is not None:
+            if not config['modbus'].get('write_batching', True) or request.slave_adress in self.single_write_slaves:
+                return request
+            merged = CoalescedWrite(request)
+
+            def select(item):
+                if item.slave_adress != merged.slave_adress:
+                    return False
+                return merged.try_add(item) or None
+        else:
+            return request
+
+        # 读请求范围扩大后之前跳过的请求可能变为相邻，重复扫描直到没有新的请求并入
+        while self.send_queue.pop_where(select):
+            pass
+        if len(merged.parts) == 1:
+            return request
+
+        merged.parts = [part for part in merged.parts if part.future.set_running_or_notify_cancel()]
+        if not merged.parts:
+            return None
+        self.logger.info(f"合并请求: {merged}")
+        return merged
+
+    def _complete_parts(self, merged):
+        """将合并请求的结果分发给各原请求，返回需要逐个重新发送的请求；分发出错时尚未完成的原请求全部以该错误失败"""
+        try:
+            return self._dispatch_parts(merged)
+        except Exception as e:
+            self.logger.error(f"分发合并请求的结果失败: {merged}: {e}")
+            for part in merged.parts:
+                if not part.future.done():
+                    part.future.set_exception(e)
+            return []
+
+    def _dispatch_parts(self, merged):
+        if not merged.future.done():
+            raise RuntimeError(f"合并请求的事务未完成: {merged}")
+        for part in merged.parts:
+            part.attempts = merged.attempts
+        exception = merged.future.exception()
+        if exception is not None:
+            for part in merged.parts:
+                part.future.set_exception(exception)
+            return []
+        frame = merged.future.result()
+        if isinstance(merged, CoalescedWrite) and frame[1] & 0x80 and frame[2] == 0x01:
+            # 从机不支持写多个，记住后逐个重新发送
+            self.single_write_slaves.add(merged.slave_adress)
+            self.logger.warning(f"从机 {merged.slave_adress} 不支持功能码 {merged.function_code:02x}，改为逐个发送写请求")
+            return merged.parts
+        for part, frame in zip(merged.parts, merged.split(frame)):
+            part.future.set_result(frame)
+        return []
+
+    def _bus_idle_delay(self):
+        """距离总线静默t3.5（再加上serial.send_time额外间隔）还需等待的秒数"""
+        guard = self.t35 + config['serial'].get('send_time', 0.0)
+        return max(self.last_rx_time, self.tx_end_time) + guard - time.monotonic()
+
+    def _wait_bus_idle(self):
+        """等待总线静默后才允许发送下一帧"""
+        while True:
+            remaining = self._bus_idle_delay()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _transact(self, request):
+        """执行发送队列中取出的请求"""
+        if not request.future.set_running_or_notify_cancel():
+            return  # 请求已被取消
+        self._exchange(request)
+
+    def _exchange(self, request):
+        """发送请求并等待匹配的应答，超时后最多重试modbus.retries次，结果写入request.future"""
+        attempts = self._begin_exchange(request)
+        if not attempts:
+            return
+        # 广播请求没有应答
+        if request.slave_adress == 0:
+            if self.send_data(request):
+                request.future.set_result(None)
+            else:
+                self._send_failed(request)
+            return
+
+        response_timeout = config['modbus'].get('response_timeout', 1.0)
+        for attempt in range(1, attempts + 1):
+            self._arm(request, attempt)
+            if not self.send_data(request):
+                self._send_failed(request)
+                return
+            if self.response_event.wait(response_timeout):
+                self._complete(request)
+                return
+            if self._timed_out(request, attempt, attempts):
+                break
+        self._give_up(request)
+
+    def _begin_exchange(self, request):
+        """
+        事务开始前的检查
+        Returns:
+            int: 最多发送次数；从机熔断中时请求已失败，返回0
+        """
+        # 写请求使对应地址的缓存失效（缓存只由发送方更新，写完成前不会被重新填充）
+        self.register_cache.invalidate_write(request)
+        if request.slave_adress == 0:
+            return 1
+
+        breaker_state = self.breaker.allow(request.slave_adress)
+        if breaker_state is None:
+            request.future.set_exception(self._breaker_error(request))
+            return 0
+        if breaker_state == STATE_HALF_OPEN:
+            self.logger.info(f"从机 {request.slave_adress} 熔断退避结束，发送探测请求: {request}")
+            return 1  # 探测请求只发送一次
+        return config['modbus']['retries'] + 1
+
+    def _arm(self, request, attempt):
+        """登记等待应答的请求"""
+        request.attempts = attempt
+        with self.pending_lock:
+            self.pending_request = request
+            self.parser.expected_length = request.reply_length()
+            self.response_frame = None
+            self.response_event.clear()
+
+    def _complete(self, request):
+        """收到应答"""
+        if self.breaker.record_success(request.slave_adress):
+            self.logger.info(f"从机 {request.slave_adress} 已恢复应答，解除熔断")
+        self.register_cache.update(request, self.response_frame)
+        request.future.set_result(self.response_frame)
+
+    def _timed_out(self, request, attempt, attempts):
+        """本次等待应答超时，从机因此熔断时返回True（不再重试）"""
+        self.logger.warning(f"等待应答超时 ({attempt}/{attempts}): {request}")
+        if self.breaker.record_failure(request.slave_adress):
+            self.logger.warning(f"从机 {request.slave_adress} 连续无应答，熔断 {self.breaker.retry_in(request.slave_adress):.1f} 秒")
+            return True
+        return False
+
+    def _send_failed(self, request):
+        with self.pending_lock:
+            self.pending_request = None
+            self.parser.expected_length = None
+        # 探测请求没有发出，不能让从机停留在半开状态（之后的allow都会拒绝）
+        if request.slave_adress and self.breaker.release(request.slave_adress):
+            self.logger.warning(f"从机 {request.slave_adress} 的探测请求发送失败，下次请求时重新探测")
+        request.future.set_exception(OSError(f"发送请求失败: {request}"))
+
+    def _give_up(self, request):
+        with self.pending_lock:
+            self.pending_request = None
+            self.parser.expected_length = None
+        request.future.set_exception(TimeoutError(f"从机无应答: {request}"))
+
+    def _breaker_error(self, request):
+        return ConnectionError(f"从机 {request.slave_adress} 熔断中，{self.breaker.retry_in(request.slave_adress):.1f} 秒后重新探测: {request}")
+
+    def send_data(self, request):
         """发送Modbus请求"""
+        frame = self._prepare_frame(request)
+        if frame is None:
+            return False
+        try:
+            self._wait_bus_idle()
+        except Exception as e:
+            self.logger.error(f"发送请求失败: {e}")
+            return False
+        return self._write_frame(frame)
+
+    def _prepare_frame(self, request):
+        """生成请求帧，串口未连接时返回None"""
         if not self.is_connected:
             self.logger.warning("串口未连接，无法发送数据")
-            return False
-            
-        request = f'{int(slave_adress):02x} {int(function_code):02x} {int(start_address):04x} {int(quantity):04x}'
-        request = bytes.fromhex(request)
-        crc = calculate_crc(request)
-        request += crc
-        
+            return None
+        # 发送过请求的从机地址作为接收重新同步的锚点
+        self.parser.add_known_slave(request.slave_adress)
+        return request.frame()
+
+    def _write_frame(self, frame):
+        """写出请求帧并记录预计发送完毕的时刻"""
         try:
-            self.serial_port.write(request)
-            self.logger.info(f"成功发送请求: {request.hex()}")
+            self.serial_port.write(frame)
+            self.tx_end_time = time.monotonic() + len(frame) * self.char_time
+            self.logger.info("成功发送请求: %s", HexDump(frame), extra=SAMPLED)
             return True
         except Exception as e:
             self.logger.error(f"发送请求失败: {e}")
@@ -380,6 +1153,8 @@ class SerialHandler:
     def disconnect(self):
         """断开串口连接"""
         try:
+            if self.poll_scheduler:
+                self.poll_scheduler.stop()
             if self.is_connected:
                 self.is_connected = False
                 self.serial_port.close()
@@ -392,11 +1167,21 @@ class SerialHandler:
 # 创建全局串口管理器实例
 serial_manager = SerialManager()
 
-def start_serial_process(com, baudrate, timeout=1):
-    """启动串口服务"""
-    handler = SerialHandler(com, baudrate, timeout)
-    if handler.connect():
+def create_handler(com, baudrate, timeout=1, slaves=None):
+    """按serial.engine创建串口处理器并连接，连接失败时返回None；serial.engine为asyncio时所有串口共用一个事件循环线程"""
+    handler_class = SerialHandler
+    if config['serial'].get('engine', 'thread') == 'asyncio':
+        from async_engine import AsyncSerialHandler as handler_class  # async_engine依赖本模块，在此处导入避免循环导入
+    handler = handler_class(com, baudrate, timeout, slaves)
+    return handler if handler.connect() else None
+
+def start_serial_process(com, baudrate, timeout=1, slaves=None):
+    """启动串口服务，serial.workers大于0时串口在工作进程中打开，本进程只保留代理"""
+    open_port = create_handler
+    if config['serial'].get('workers', 0) > 0:
+        from port_shards import open_remote_port as open_port  # port_shards依赖本模块，在此处导入避免循环导入
+    handler = open_port(com, baudrate, timeout, slaves)
+    if handler is not None:
         serial_manager.serial_ports[com] = handler
         return True
     return False
-    
@@ -0,0 +1,284 @@
+# TCP JSON协议的消息分帧：旧版花括号匹配、NDJSON、4字节长度前缀
+
+import json
+import re
+
+FRAMING_LEGACY = 'legacy'   # 按花括号配对切分，兼容旧客户端
+FRAMING_NDJSON = 'ndjson'   # 每行一个JSON对象，以\n结尾
+FRAMING_LENGTH = 'length'   # 4字节大端长度 + JSON
+
+# 旧版分帧只关心这几个字符
+_SPECIAL_BYTES = re.compile(rb'[{}"\\]')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_BLANK = re.compile(rb'[ \t\r]*')
+
+# 已读数据超过该大小时才整体前移缓冲区
+COMPACT_THRESHOLD = 64 * 1024
+
+class FrameError(ValueError):
+    """单条消息无法解析或超过长度限制，连接仍可继续使用"""
+
+class _StreamDecoder:
+    """
+    流式解码的公共部分
+    - 数据追加在bytearray末尾，通过读偏移消费，只在偏移足够大时才前移剩余数据
+    - 消息切分出来后直接从缓冲区视图解码并用raw_decode解析，不复制中间bytes
+    """
+    name = None
+
+    def __init__(self, max_bytes=None):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.max_bytes = max_bytes
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, data):
+        """追加接收到的数据"""
+        if self.offset:
+            if self.offset == len(self.buffer):
+                self.buffer.clear()
+                self._shift(self.offset)
+            elif self.offset >= COMPACT_THRESHOLD:
+                del self.buffer[:self.offset]
+                self._shift(self.offset)
+        self.buffer += data
+
+    def _shift(self, count):
+        """缓冲区前移count字节后修正各位置"""
+        self.offset -= count
+
+    def _too_large(self, size):
+        return self.max_bytes is not None and size > self.max_bytes
+
+    def _size_error(self):
+        return FrameError(f"接收数据超过最大限制: {self.max_bytes} 字节")
+
+    def _decode(self, start, end):
+        """解析buffer[start:end]中的一个JSON值"""
+        try:
+            with memoryview(self.buffer)[start:end] as view:
+                text = str(view, 'utf-8')
+            obj, pos = self.decoder.raw_decode(text, _WHITESPACE.match(text).end())
+        except ValueError as e:  # 包含UnicodeDecodeError和JSONDecodeError
+            raise FrameError(f"JSON解析失败: {e}")
+        if _WHITESPACE.match(text, pos).end() != len(text):
+            raise FrameError(f"JSON解析失败: 第 {pos} 个字符后有多余数据")
+        return obj
+
+    def next_message(self):
+        """
+        返回下一条已解析的消息，数据不足时返回None
+        Raises:
+            FrameError: 当前消息无效或超长，已被丢弃，可继续调用
+        """
+        raise NotImplementedError
+
+    def detach(self):
+        """取出尚未处理的原始数据（切换分帧方式时使用）"""
+        data = bytes(self.buffer[self.offset:])
+        self.buffer = bytearray()
+        self.offset = 0
+        return data
+
+    def encode(self, message):
+        raise NotImplementedError
+
+class LegacyFramer(_StreamDecoder):
+    """
+    花括号配对分帧
+    - 记录扫描位置、嵌套深度和字符串状态，每个字节只扫描一次
+    - 忽略字符串内部的花括号
+    - 消息在结束前超过长度限制即报错，其余部分边扫描边丢弃
+    """
+    name = FRAMING_LEGACY
+
+    def __init__(self, max_bytes=None):
+        super().__init__(max_bytes)
+        self.scan = 0        # 下次扫描的位置
+        self.start = -1      # 当前消息起始位置，-1表示尚未找到'{'
+        self.depth = 0
+        self.in_string = False
+        self.discarding = False  # 当前消息超长，丢弃到其结束为止
+
+    def _shift(self, count):
+        super()._shift(count)
+        self.scan -= count
+        if self.start >= 0:
+            self.start -= count
+
+    def next_message(self):
+        buffer = self.buffer
+        while True:
+            if self.start < 0:
+                start = buffer.find(b'{', self.offset)
+                if start == -1:
+                    # 没有找到开始标记，丢弃已接收的数据
+                    self.offset = self.scan = len(buffer)
+                    return None
+                self.start = self.offset = self.scan = start
+                self.depth = 0
+                self.in_string = False
+
+            pos = self.scan
+            complete = False
+            while True:
+                match = _SPECIAL_BYTES.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                char = buffer[match.start()]
+                pos = match.end()
+                if self.in_string:
+                    if char == 0x5C:  # 反斜杠转义下一个字符
+                        if pos >= len(buffer):
+                            pos = match.start()
+                            break
+                        pos += 1
+                    elif char == 0x22:
+                        self.in_string = False
+                elif char == 0x22:
+                    self.in_string = True
+                elif char == 0x7B:
+                    self.depth += 1
+                elif char == 0x7D:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        complete = True
+                        break
+            self.scan = pos
+
+            if complete:
+                # 找到完整消息
+                start = self.start
+                self.offset = pos
+                self.start = -1
+                if self.discarding:
+                    self.discarding = False
+                    continue
+                if self._too_large(pos - start):
+                    raise self._size_error()
+                return self._decode(start, pos)
+
+            # 消息未结束
+            if self.discarding:
+                # 已扫描部分不再需要
+                self.offset = self.start = self.scan
+                return None
+            if self._too_large(self.scan - self.start):
+                self.discarding = True
+                self.offset = self.start = self.scan
+                raise self._size_error()
+            return None
+
+    def detach(self):
+        if self.start >= 0:
+            self.offset = self.start
+        self.scan = 0
+        self.start = -1
+        self.discarding = False
+        return super().detach()
+
+    def encode(self, message):
+        return json.dumps(message).encode('utf-8')
+
+class NdjsonFramer(_StreamDecoder):
+    """换行分隔，每行一个JSON对象"""
+    name = FRAMING_NDJSON
+
+    def __init__(self, max_bytes=None):
+        super().__init__(max_bytes)
+        self.scan = 0
+        self.discarding = False  # 当前行超长，丢弃到换行为止
+
+    def _shift(self, count):
+        super()._shift(count)
+        self.scan -= count
+
+    def next_message(self):
+        while True:
+            end = self.buffer.find(b'\n', self.scan)
+            if end == -1:
+                self.scan = len(self.buffer)
+                if self.discarding:
+                    self.offset = self.scan
+                elif self._too_large(self.scan - self.offset):
+                    self.discarding = True
+                    self.offset = self.scan
+                    raise self._size_error()
+                return None
+
+            start = self.offset
+            self.offset = self.scan = end + 1
+            if self.discarding:
+                self.discarding = False
+                continue
+            if self._too_large(end - start):
+                raise self._size_error()
+            if _BLANK.match(self.buffer, start, end).end() == end:
+                continue  # 空行
+            return self._decode(start, end)
+
+    def detach(self):
+        self.scan = 0
+        self.discarding = False
+        return super().detach()
+
+    def encode(self, message):
+        return json.dumps(message).encode('utf-8') + b'\n'
+
+class LengthPrefixFramer(_StreamDecoder):
+    """4字节大端无符号长度前缀 + JSON内容"""
+    name = FRAMING_LENGTH
+
+    def __init__(self, max_bytes=None):
+        super().__init__(max_bytes)
+        self.skip = 0  # 超长消息尚未丢弃的字节数
+
+    def next_message(self):
+        if self.skip:
+            count = min(self.skip, len(self.buffer) - self.offset)
+            self.offset += count
+            self.skip -= count
+            if self.skip:
+                return None
+
+        if len(self.buffer) - self.offset < 4:
+            return None
+        start = self.offset + 4
+        length = int.from_bytes(self.buffer[self.offset:start], 'big')
+        if self._too_large(length):
+            # 不等待消息体到达，直接报错并跳过
+            self.offset = start
+            self.skip = length
+            raise self._size_error()
+        if len(self.buffer) < start + length:
+            return None
+        self.offset = start + length
+        return self._decode(start, start + length)
+
+    def detach(self):
+        self.skip = 0
+        return super().detach()
+
+    def encode(self, message):
+        payload = json.dumps(message).encode('utf-8')
+        return len(payload).to_bytes(4, 'big') + payload
+
+FRAMERS = {
+    FRAMING_LEGACY: LegacyFramer,
+    FRAMING_NDJSON: NdjsonFramer,
+    FRAMING_LENGTH: LengthPrefixFramer,
+}
+
+def create_framer(name, max_bytes=None):
+    """按名称创建分帧器
+    Args:
+        name: 分帧方式
+        max_bytes: 单条消息的最大字节数，None表示不限制
+    Raises:
+        ValueError: 不支持的分帧方式
+    """
+    framer_class = FRAMERS.get(name)
+    if framer_class is None:
+        raise ValueError(f"不支持的分帧方式: {name}，可选: {', '.join(FRAMERS)}")
+    return framer_class(max_bytes)
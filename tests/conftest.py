@@ -0,0 +1,5 @@
+# 测试直接导入modbus目录下的模块（与程序运行时相同的平铺导入方式），不经过包的__init__
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modbus'))
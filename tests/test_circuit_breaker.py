@@ -0,0 +1,102 @@
+# circuit_breaker的单元测试
+
+import unittest
+from unittest import mock
+
+from circuit_breaker import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('circuit_breaker.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(threshold=3, backoff=1.0, max_backoff=4.0)
+
+    def trip(self, slave=1):
+        for _ in range(self.breaker.threshold):
+            tripped = self.breaker.record_failure(slave)
+        return tripped
+
+    def state(self, slave=1):
+        return self.breaker.status()[slave]["state"]
+
+    def test_trips_after_threshold_failures(self):
+        self.assertFalse(self.breaker.record_failure(1))
+        self.assertFalse(self.breaker.record_failure(1))
+        self.assertTrue(self.breaker.record_failure(1))
+        self.assertTrue(self.breaker.is_open(1))
+        self.assertIsNone(self.breaker.allow(1))
+        self.assertEqual(self.breaker.retry_in(1), 1.0)
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure(1)
+        self.breaker.record_failure(1)
+        self.assertFalse(self.breaker.record_success(1))
+        self.assertFalse(self.breaker.record_failure(1))
+        self.assertEqual(self.breaker.allow(1), STATE_CLOSED)
+
+    def test_backoff_expiry_lets_one_probe_through(self):
+        self.trip()
+        self.clock.now += 1.0
+        self.assertFalse(self.breaker.is_open(1))
+        self.assertEqual(self.breaker.allow(1), STATE_HALF_OPEN)
+        # 探测请求未完成前不再放行其他请求
+        self.assertIsNone(self.breaker.allow(1))
+        self.assertEqual(self.state(), STATE_HALF_OPEN)
+
+    def test_probe_success_closes(self):
+        self.trip()
+        self.clock.now += 1.0
+        self.breaker.allow(1)
+        self.assertTrue(self.breaker.record_success(1))
+        self.assertEqual(self.state(), STATE_CLOSED)
+        self.assertEqual(self.breaker.allow(1), STATE_CLOSED)
+
+    def test_probe_failure_doubles_backoff_up_to_max(self):
+        self.trip()
+        for expected in (2.0, 4.0, 4.0):
+            self.clock.now += self.breaker.retry_in(1)
+            self.assertEqual(self.breaker.allow(1), STATE_HALF_OPEN)
+            self.assertTrue(self.breaker.record_failure(1))
+            self.assertEqual(self.state(), STATE_OPEN)
+            self.assertEqual(self.breaker.retry_in(1), expected)
+        self.assertEqual(self.breaker.status()[1]["trips"], 1)
+
+    def test_release_returns_undelivered_probe_to_open(self):
+        self.trip()
+        self.clock.now += 1.0
+        self.breaker.allow(1)
+        self.assertTrue(self.breaker.release(1))
+        self.assertEqual(self.state(), STATE_OPEN)
+        # 退避不加倍，下一个请求立即重新探测
+        self.assertEqual(self.breaker.allow(1), STATE_HALF_OPEN)
+        self.assertTrue(self.breaker.record_failure(1))
+        self.assertEqual(self.breaker.retry_in(1), 2.0)
+
+    def test_release_ignores_closed_and_open_slaves(self):
+        self.assertFalse(self.breaker.release(1))
+        self.trip()
+        self.assertFalse(self.breaker.release(1))
+        self.assertIsNone(self.breaker.allow(1))
+
+    def test_slaves_are_independent(self):
+        self.trip(1)
+        self.assertEqual(self.breaker.allow(2), STATE_CLOSED)
+        self.assertFalse(self.breaker.is_open(2))
+
+    def test_zero_threshold_never_trips(self):
+        breaker = CircuitBreaker(threshold=0, backoff=1.0, max_backoff=4.0)
+        for _ in range(10):
+            self.assertFalse(breaker.record_failure(1))
+        self.assertEqual(breaker.allow(1), STATE_CLOSED)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# 合并读/写请求拆分应答的单元测试
+
+import unittest
+
+from crc import calculate_crc
+
+try:
+    from serial_serve import CoalescedRead, CoalescedWrite, ModbusRequest
+except ImportError:  # 未安装pyserial
+    ModbusRequest = None
+
+def make_frame(*body):
+    body = bytes(body)
+    return body + calculate_crc(body)
+
+def merge(*requests):
+    merged = CoalescedRead(requests[0])
+    for request in requests[1:]:
+        assert merged.try_add(request, 0)
+    return merged
+
+@unittest.skipIf(ModbusRequest is None, "需要pyserial")
+class CoalescedReadTest(unittest.TestCase):
+    def test_register_reply_split_by_address(self):
+        merged = merge(ModbusRequest.read(1, 3, 10, 2), ModbusRequest.read(1, 3, 12, 1))
+        self.assertEqual(merged.read_range(), (10, 3))
+        reply = make_frame(0x01, 0x03, 0x06, 0x00, 0x01, 0x00, 0x02, 0x00, 0x03)
+        self.assertTrue(merged.matches(reply))
+        self.assertEqual(merged.split(reply), [
+            make_frame(0x01, 0x03, 0x04, 0x00, 0x01, 0x00, 0x02),
+            make_frame(0x01, 0x03, 0x02, 0x00, 0x03),
+        ])
+
+    def test_overlapping_register_reads(self):
+        merged = merge(ModbusRequest.read(1, 4, 0, 3), ModbusRequest.read(1, 4, 1, 1))
+        reply = make_frame(0x01, 0x04, 0x06, 0x00, 0x0A, 0x00, 0x0B, 0x00, 0x0C)
+        self.assertEqual(merged.split(reply)[1], make_frame(0x01, 0x04, 0x02, 0x00, 0x0B))
+
+    def test_coil_reply_split_realigns_bits(self):
+        merged = merge(ModbusRequest.read(1, 1, 0, 4), ModbusRequest.read(1, 1, 4, 12))
+        # 线圈0-3为1，4-7为1，8-11为1，12-15为0
+        reply = make_frame(0x01, 0x01, 0x02, 0xFF, 0x0F)
+        self.assertEqual(merged.split(reply), [
+            make_frame(0x01, 0x01, 0x01, 0x0F),
+            make_frame(0x01, 0x01, 0x02, 0xFF, 0x00),
+        ])
+
+    def test_coil_split_across_byte_boundary(self):
+        merged = merge(ModbusRequest.read(1, 2, 0, 3), ModbusRequest.read(1, 2, 3, 7))
+        # 输入0-9依次为 1 0 1 | 1 0 0 1 1 0 1
+        reply = make_frame(0x01, 0x02, 0x02, 0b11001101, 0b10)
+        self.assertEqual(merged.split(reply), [
+            make_frame(0x01, 0x02, 0x01, 0b101),
+            make_frame(0x01, 0x02, 0x01, 0b1011001),
+        ])
+
+    def test_exception_reply_shared_by_all_parts(self):
+        merged = merge(ModbusRequest.read(1, 3, 0, 1), ModbusRequest.read(1, 3, 1, 1))
+        reply = make_frame(0x01, 0x83, 0x02)
+        self.assertTrue(merged.matches(reply))
+        self.assertEqual(merged.split(reply), [reply, reply])
+
+    def test_reply_with_wrong_byte_count_is_rejected(self):
+        merged = merge(ModbusRequest.read(1, 1, 0, 4), ModbusRequest.read(1, 1, 4, 12))
+        reply = make_frame(0x01, 0x01, 0x01, 0xFF)
+        self.assertFalse(merged.matches(reply))
+        with self.assertRaises(ValueError):
+            merged.split(reply)
+
+    def test_does_not_merge_other_slave_or_distant_range(self):
+        merged = CoalescedRead(ModbusRequest.read(1, 3, 0, 2))
+        self.assertFalse(merged.try_add(ModbusRequest.read(2, 3, 2, 2), 0))
+        self.assertFalse(merged.try_add(ModbusRequest.read(1, 4, 2, 2), 0))
+        self.assertFalse(merged.try_add(ModbusRequest.read(1, 3, 5, 2), 0))
+        self.assertTrue(merged.try_add(ModbusRequest.read(1, 3, 5, 2), 3))
+        self.assertFalse(merged.try_add(ModbusRequest.read(1, 3, 7, 120), 0))
+
+@unittest.skipIf(ModbusRequest is None, "需要pyserial")
+class CoalescedWriteTest(unittest.TestCase):
+    def test_consecutive_single_writes_become_write_multiple(self):
+        first = ModbusRequest.write(1, 6, 10, 0x1234)
+        second = ModbusRequest.write(1, 6, 11, 0x5678)
+        merged = CoalescedWrite(first)
+        self.assertTrue(merged.try_add(second))
+        self.assertFalse(merged.try_add(ModbusRequest.write(1, 6, 20, 1)))
+        self.assertEqual(merged.function_code, 0x10)
+        self.assertEqual(merged.payload, bytes.fromhex('000a00020412345678'))
+        reply = make_frame(0x01, 0x10, 0x00, 0x0A, 0x00, 0x02)
+        self.assertEqual(merged.split(reply), [first.frame(), second.frame()])
+
+    def test_exception_reply_uses_single_write_function(self):
+        merged = CoalescedWrite(ModbusRequest.write(1, 5, 0, 1))
+        merged.try_add(ModbusRequest.write(1, 5, 1, 0))
+        self.assertEqual(merged.split(make_frame(0x01, 0x8F, 0x01)), [make_frame(0x01, 0x85, 0x01)] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
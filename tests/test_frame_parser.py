@@ -0,0 +1,103 @@
+# frame_parser的单元测试
+
+import logging
+import unittest
+
+from crc import calculate_crc
+from frame_parser import ModbusFrameParser
+
+# 重新同步的警告日志不输出到测试结果中
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+def make_frame(*body):
+    body = bytes(body)
+    return body + calculate_crc(body)
+
+# 从机1读2个保持寄存器的应答，共9字节
+REPLY = make_frame(0x01, 0x03, 0x04, 0x00, 0x0A, 0x00, 0x0B)
+# 从机1读1个保持寄存器的应答，共7字节
+SHORT_REPLY = make_frame(0x01, 0x03, 0x02, 0x12, 0x34)
+
+class ByteBuffer:
+    """接收缓冲区的最小实现，只提供解析器用到的接口"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data.extend(data)
+
+    def peek(self, count):
+        return bytes(self.data[:count])
+
+    def discard(self, count):
+        count = min(count, len(self.data))
+        del self.data[:count]
+        return count
+
+    def length(self):
+        return len(self.data)
+
+class FrameParserTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = ByteBuffer()
+        self.parser = ModbusFrameParser(self.buffer, logger, [1])
+
+    def feed(self, data):
+        self.buffer.write(data)
+        return self.parser.parse()
+
+    def test_frames_split_across_chunks(self):
+        self.assertEqual(self.feed(REPLY[:4]), [])
+        self.assertEqual(self.feed(REPLY[4:] + SHORT_REPLY), [REPLY, SHORT_REPLY])
+        self.assertEqual(self.buffer.length(), 0)
+        self.assertEqual(self.parser.resync_count, 0)
+
+    def test_crc_error_resyncs_to_next_frame(self):
+        corrupt = bytearray(REPLY)
+        corrupt[4] ^= 0xFF
+        self.assertEqual(self.feed(bytes(corrupt) + SHORT_REPLY), [SHORT_REPLY])
+        self.assertEqual(self.parser.crc_error_count, 1)
+        self.assertEqual(self.parser.resync_count, 1)
+
+    def test_garbage_before_frame_is_discarded(self):
+        self.assertEqual(self.feed(b'\x00\xff\x7e' + REPLY), [REPLY])
+        self.assertEqual(self.parser.discarded_bytes, 3)
+
+    def test_corrupt_byte_count_does_not_hold_back_valid_frames(self):
+        # 损坏的帧头声明240字节，其后的完整应答不应等到凑满240字节才解析出来
+        frames = self.feed(b'\x01\x03\xf0' + SHORT_REPLY)
+        self.assertEqual(frames, [SHORT_REPLY])
+        self.assertEqual(self.feed(SHORT_REPLY), [SHORT_REPLY])
+        self.assertEqual(self.buffer.length(), 0)
+
+    def test_byte_count_longer_than_expected_reply(self):
+        self.parser.expected_length = len(SHORT_REPLY)
+        self.assertEqual(self.feed(b'\x01\x03\xf0\x00'), [])
+        self.assertTrue(self.parser.resyncing)
+        self.assertEqual(self.feed(SHORT_REPLY), [SHORT_REPLY])
+
+    def test_silence_abandons_incomplete_frame(self):
+        self.assertEqual(self.feed(b'\x01\x03\xf0\x00\x00'), [])
+        self.parser.silence()
+        self.assertEqual(self.feed(SHORT_REPLY[:3]), [])
+        self.assertEqual(self.feed(SHORT_REPLY[3:]), [SHORT_REPLY])
+        self.assertEqual(self.buffer.length(), 0)
+
+    def test_silence_inside_valid_frame_keeps_it(self):
+        # 串口驱动分段造成的静默不应丢失该帧
+        self.assertEqual(self.feed(REPLY[:5]), [])
+        self.parser.silence()
+        self.assertEqual(self.feed(REPLY[5:]), [REPLY])
+        self.assertEqual(self.parser.resync_count, 0)
+        self.assertEqual(self.parser.discarded_bytes, 0)
+
+    def test_silence_between_frames_is_ignored(self):
+        self.assertEqual(self.feed(REPLY), [REPLY])
+        self.parser.silence()
+        self.assertFalse(self.parser.resyncing)
+        self.assertEqual(self.feed(SHORT_REPLY), [SHORT_REPLY])
+
+if __name__ == '__main__':
+    unittest.main()
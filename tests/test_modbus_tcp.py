@@ -0,0 +1,83 @@
+# Modbus TCP网关请求处理的单元测试（不打开串口和监听端口）
+
+import asyncio
+import logging
+import unittest
+from concurrent.futures import Future
+
+try:
+    from modbus_tcp import ModbusTcpGateway, MBAP_HEADER, logger
+    from serial_serve import serial_manager
+except ImportError:  # 未安装pyserial
+    ModbusTcpGateway = None
+
+class FakeWriter:
+    def __init__(self):
+        self.data = bytearray()
+        self.drained = 0
+
+    def write(self, data):
+        self.data.extend(data)
+
+    async def drain(self):
+        self.drained += 1
+
+    def is_closing(self):
+        return False
+
+class FakeHandler:
+    """submit的行为由测试指定"""
+    def __init__(self, submit):
+        self.submit = submit
+        self.logger = logging.getLogger(__name__)
+
+def cancelled_future(request):
+    future = Future()
+    future.cancel()
+    return future
+
+def broken_submit(request):
+    raise ValueError("bad request")
+
+@unittest.skipIf(ModbusTcpGateway is None, "需要pyserial")
+class GatewayProcessTest(unittest.TestCase):
+    def setUp(self):
+        logger.disabled = True
+        self.addCleanup(setattr, logger, 'disabled', False)
+        self.addCleanup(serial_manager.serial_ports.pop, "TEST", None)
+        self.gateway = ModbusTcpGateway({1: "TEST"}, timeout=1.0)
+
+    def process(self, submit):
+        serial_manager.serial_ports["TEST"] = FakeHandler(submit)
+        writer = FakeWriter()
+
+        async def run():
+            slots = asyncio.Semaphore(1)
+            await slots.acquire()
+            await self.gateway._process(writer, 7, 1, bytes.fromhex('0300000001'), slots)
+            self.assertFalse(slots.locked())
+
+        asyncio.run(run())
+        return writer
+
+    def assert_exception_reply(self, writer, code):
+        transaction_id, _, length, unit_id = MBAP_HEADER.unpack(writer.data[:MBAP_HEADER.size])
+        self.assertEqual((transaction_id, length, unit_id), (7, 3, 1))
+        self.assertEqual(bytes(writer.data[MBAP_HEADER.size:]), bytes([0x83, code]))
+        self.assertEqual(writer.drained, 1)
+
+    def test_cancelled_future_gets_slave_device_failure(self):
+        self.assert_exception_reply(self.process(cancelled_future), 0x04)
+
+    def test_unexpected_error_gets_slave_device_failure(self):
+        self.assert_exception_reply(self.process(broken_submit), 0x04)
+
+    def test_breaker_error_gets_gateway_target_failed(self):
+        def open_breaker(request):
+            future = Future()
+            future.set_exception(ConnectionError("熔断中"))
+            return future
+        self.assert_exception_reply(self.process(open_breaker), 0x0B)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+# 轮询表配置项检查的单元测试
+
+import unittest
+
+try:
+    from poll_scheduler import PollTask
+except ImportError:  # 未安装pyserial
+    PollTask = None
+
+def poll_item(**overrides):
+    item = {'slave': 1, 'function_code': 3, 'start_address': 0, 'quantity': 10, 'period': 1.0}
+    item.update(overrides)
+    return item
+
+@unittest.skipIf(PollTask is None, "需要pyserial")
+class PollTaskConfigTest(unittest.TestCase):
+    def test_valid_item(self):
+        task = PollTask.from_config(poll_item(priority=2))
+        self.assertEqual((task.function_code, task.quantity, task.period, task.priority), (3, 10, 1.0, 2))
+
+    def test_rejects_illegal_reads(self):
+        for overrides in (
+            {'function_code': 6},
+            {'quantity': 0},
+            {'quantity': 126},
+            {'function_code': 1, 'quantity': 2001},
+            {'start_address': -1},
+            {'start_address': 65530, 'quantity': 10},
+            {'period': 0},
+        ):
+            with self.subTest(**overrides), self.assertRaises(ValueError):
+                PollTask.from_config(poll_item(**overrides))
+
+if __name__ == '__main__':
+    unittest.main()
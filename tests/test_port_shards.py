@@ -0,0 +1,75 @@
+# 串口分片前端消息处理和共享内存帧环形缓冲区的单元测试（不启动工作进程）
+
+import logging
+import unittest
+
+try:
+    from port_shards import FrameRing, PortShard, PortProxy, logger
+except ImportError:  # 未安装pyserial
+    PortShard = None
+
+@unittest.skipIf(PortShard is None, "需要pyserial")
+class ShardMessageTest(unittest.TestCase):
+    def setUp(self):
+        logger.disabled = True
+        self.addCleanup(setattr, logger, 'disabled', False)
+        self.shard = PortShard.__new__(PortShard)
+        self.shard.index = 0
+        self.shard.proxies = {}
+        self.sent = []
+        self.shard.send = self.sent.append
+
+    def test_opened_for_current_proxy(self):
+        proxy = PortProxy(self.shard, 0, "TEST")
+        proxy.logger.addHandler(logging.NullHandler())
+        self.shard.proxies[0] = proxy
+        self.shard._handle_message(('opened', 0, True))
+        self.assertTrue(proxy.opened.is_set())
+        self.assertTrue(proxy.is_connected)
+
+    def test_late_opened_closes_abandoned_port(self):
+        self.shard._handle_message(('opened', 3, True))
+        self.assertEqual(self.sent, [('disconnect', 3)])
+        self.shard._handle_message(('opened', 4, False))
+        self.assertEqual(self.sent, [('disconnect', 3)])
+
+    def test_unknown_message_is_ignored(self):
+        self.shard._handle_message(('bogus', 1))
+        self.assertEqual(self.sent, [])
+
+@unittest.skipIf(PortShard is None, "需要pyserial")
+class FrameRingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRing.create(0)  # 最小容量512字节
+        self.addCleanup(self.ring.close, True)
+
+    def test_round_trip_in_order(self):
+        self.assertIsNone(self.ring.get())
+        self.assertTrue(self.ring.put(1, 1.5, b'\x01\x03\x02\x00\x01'))
+        self.assertTrue(self.ring.put(2, 2.5, b''))
+        self.assertEqual(self.ring.get(), (1, 1.5, b'\x01\x03\x02\x00\x01'))
+        self.assertEqual(self.ring.get(), (2, 2.5, b''))
+        self.assertIsNone(self.ring.get())
+
+    def test_full_ring_rejects_and_wraps_after_reads(self):
+        frame = bytes(116)  # 加上12字节记录头，每条记录占128字节
+        for i in range(self.ring.capacity // 128):
+            self.assertTrue(self.ring.put(i, 0.0, frame))
+        self.assertFalse(self.ring.put(99, 0.0, frame))
+        self.assertEqual(self.ring.get()[0], 0)
+        # 读出一条后有空间，写入回绕到数据区开头
+        self.assertTrue(self.ring.put(99, 0.0, frame))
+        indexes = [self.ring.get()[0] for _ in range(self.ring.capacity // 128)]
+        self.assertEqual(indexes[-1], 99)
+        self.assertIsNone(self.ring.get())
+
+    def test_record_that_does_not_fit_before_end_wraps(self):
+        self.assertTrue(self.ring.put(0, 0.0, bytes(400)))
+        self.assertEqual(self.ring.get()[0], 0)
+        # 末尾只剩96字节，放不下该记录，写入回绕标记后从开头写
+        self.assertTrue(self.ring.put(1, 0.0, bytes(200)))
+        self.assertEqual(self.ring.get(), (1, 0.0, bytes(200)))
+        self.assertIsNone(self.ring.get())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# 串口处理器事务流程的单元测试（不打开真实串口）
+
+import asyncio
+import logging
+import unittest
+
+try:
+    from serial_serve import SerialHandler, ModbusRequest
+    from async_engine import AsyncSerialHandler
+    from circuit_breaker import CircuitBreaker, STATE_HALF_OPEN, STATE_OPEN
+except ImportError:  # 未安装pyserial
+    SerialHandler = None
+
+class BrokenPort:
+    """写入总是失败的串口"""
+    def write(self, data):
+        raise OSError("device disconnected")
+
+def make_handler(handler_class):
+    handler = handler_class("TEST", 9600)
+    handler.logger.addHandler(logging.NullHandler())
+    handler.serial_port = BrokenPort()
+    handler.is_connected = True
+    # 一次无应答即熔断，退避为0：下一个请求就是探测请求
+    handler.breaker = CircuitBreaker(1, 0.0, 0.0)
+    handler.breaker.record_failure(1)
+    return handler
+
+@unittest.skipIf(SerialHandler is None, "需要pyserial")
+class FailedProbeSendTest(unittest.TestCase):
+    def assert_probe_released(self, handler, request):
+        self.assertIsInstance(request.future.exception(timeout=0), OSError)
+        self.assertEqual(handler.breaker.status()[1]["state"], STATE_OPEN)
+        # 从机没有停留在半开状态，下一个请求仍可作为探测请求发送
+        self.assertEqual(handler.breaker.allow(1), STATE_HALF_OPEN)
+
+    def test_thread_engine(self):
+        handler = make_handler(SerialHandler)
+        request = ModbusRequest.read(1, 3, 0, 1)
+        request.future.set_running_or_notify_cancel()
+        handler._exchange(request)
+        self.assert_probe_released(handler, request)
+
+    def test_asyncio_engine(self):
+        handler = make_handler(AsyncSerialHandler)
+        request = ModbusRequest.read(1, 3, 0, 1)
+        request.future.set_running_or_notify_cancel()
+
+        async def exchange():
+            handler.response_ready = asyncio.Event()
+            await handler._exchange_async(request)
+
+        asyncio.run(exchange())
+        self.assert_probe_released(handler, request)
+
+if __name__ == '__main__':
+    unittest.main()